@@ -1,6 +1,13 @@
 import gmsh
+import os
+import sys
 import math
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # mesh_tools.py is one folder up
+from mesh_tools import (setMeshSize, setCurvatureSizing, setName, copyNamed, booleanNamed, nameSurfaces, addNamedGroups,
+    writeMultigridHierarchy, writePreview, checkClearance, writeRotatedMeshes, renumberMesh, writeCostReport,
+    meshSurfacesWithCheckpoint, meshVolumes, startPhase, printMemoryReport, startWatch)
+
 gmsh.initialize()
 
 ######## MODEL PARAMETERS ########
@@ -12,6 +19,16 @@ leg_radius = 0.2 # landing leg radius
 boundary_radius = 35 # boundary cylinder radius
 boundary_height = 15 # bboundary cylinder height
 tolerance = 0.05 # empty space between surfaces of different physical groups
+check_clearance = True # stop before the boolean cut if two physical groups are closer than min_clearance
+min_clearance = 0.5 * tolerance
+cost_report = False # estimate the elements that thin features and narrow gaps cost, ranked in blue_moon_cost.txt
+
+######## FAR FIELD PARAMETERS ########
+
+nested_far_field = False # split the boundary into a refined inner cylinder and a coarse outer shell of prism layers
+inner_boundary_radius = 8 # inner cylinder radius
+inner_boundary_height = 22 # inner cylinder height, measured from the lunar surface
+far_field_layers = 36 # number of prism layers around the axis in the outer shell
 
 ######## MESH PARAMETERS ########
 
@@ -21,34 +38,109 @@ meshsize_tanks = 0.2 * tank_radius # radially mounted tanks
 meshsize_landinglegs = 0.3 * leg_radius # landing legs
 meshsize_space = 0.5 # top and side boundaries (space)
 meshsize_ground = 0.5 # lunar surface boundary
-
-# function to set the mesh size of surfaces from its physical group tag
-def setMeshSize(physical_group, mesh_size):
-    
-    gmsh.model.occ.synchronize()
-
-    # gets the lines that make up each physical surface, and then the points that make up each of those lines
-    points = []
-    for tag in gmsh.model.getEntitiesForPhysicalGroup(2, physical_group):
-        _, line = gmsh.model.getAdjacencies(2, tag)
-        for i in line:
-            _, pts = gmsh.model.getAdjacencies(1, i)
-            points.append(pts)
-    
-    points = list(set([item for sublist in points for item in sublist])) # flatten and filter out any duplicate points in tag list
-
-    # change the formatting to be (dim, tag) list
-    entities = []
-    for tag in points:
-        entities.append((0, tag))
-    
-    gmsh.model.mesh.setSize(entities, mesh_size)
+meshsize_interface = 0.5 # surface between the inner cylinder and the outer shell (nested far field)
+memory_budget = 0 # abort the build if it uses more than this many MB of memory (0 for no limit)
+stage_timeouts = {"2D": 0, "3D": 0} # abort a meshing stage if it takes longer than this many seconds (0 for no limit)
+progress_log = None # file to append the meshing progress to
+print_progress = False # print every curve, surface and volume as it starts meshing
+renumbering = None # "RCMK" or "Hilbert" to reorder the nodes and elements for solver locality (not with multigrid)
+sweep_angles = [] # also write the mesh rotated about the z axis by each of these angles (degrees), for orientation sweeps
+multigrid_levels = 1 # write this many nested meshes for multigrid, the finest one is meshed at the sizes above
+# NOTE: the coarsest level is meshed at 2 ** (multigrid_levels - 1) times the sizes above, which doesn't resolve the
+# narrow gaps between the parts (0.05 to 0.1): already with 2 levels the 3D mesh fails ("PLC Error: A segment and a
+# facet intersect"), so the script stops right away with more than 1 level until the lander is spaced out further
+curvature_sizing = None # "replace" or "add" to size the mesh from the curvature of the surfaces, instead of or on top of the sizes above
+curvature_points = 20 # elements per 2 pi of curvature
+curvature_clamp = (0.25, 1) # the curvature sizes are kept between these factors of the mesh size of each physical group
+preview = False # only mesh the surfaces and write blue_moon_preview.stl, to check the geometry quickly
+surface_checkpoint = False # reuse the spacecraft surface mesh saved in blue_moon_surface.ckpt when only the far field changed
+
+# function to build the boundary as an inner cylinder (meshed with tets) nested inside an outer shell. the shell
+# is made by revolving its L shaped cross section around the axis, so it gets meshed as layers of prisms that are
+# conformal with the surface of the inner cylinder. gmsh only extrudes a mesh by revolution for angles below 2*pi,
+# so the shell is revolved in quarters, and the inner cylinder is fused from quarters with their faces left apart
+# (the prisms don't match a whole cylinder, whose side is one periodic face). returns the inner volume and the
+# shell volumes
+def addNestedBoundary(x, y, z, dz, r, inner_dz, inner_r, layers):
+
+    quarters = []
+    for index in range(4):
+        quarters.append((3, gmsh.model.occ.addCylinder(x, y, z, 0, 0, inner_dz, inner_r, angle=math.pi / 2)))
+        gmsh.model.occ.rotate([quarters[-1]], x, y, z, 0, 0, 1, index * math.pi / 2)
+
+    unify = gmsh.option.getNumber("Geometry.OCCUnionUnify")
+    gmsh.option.setNumber("Geometry.OCCUnionUnify", 0)
+    inner = gmsh.model.occ.fuse(quarters[:1], quarters[1:])[0][0][1]
+    gmsh.option.setNumber("Geometry.OCCUnionUnify", unify)
+
+    # cross section of the shell in the xz plane
+    p1 = gmsh.model.occ.addPoint(x + inner_r, y, z)
+    p2 = gmsh.model.occ.addPoint(x + r, y, z)
+    p3 = gmsh.model.occ.addPoint(x + r, y, z + dz)
+    p4 = gmsh.model.occ.addPoint(x, y, z + dz)
+    p5 = gmsh.model.occ.addPoint(x, y, z + inner_dz)
+    p6 = gmsh.model.occ.addPoint(x + inner_r, y, z + inner_dz)
+
+    lines = []
+    for start, end in [(p1, p2), (p2, p3), (p3, p4), (p4, p5), (p5, p6), (p6, p1)]:
+        lines.append(gmsh.model.occ.addLine(start, end))
+    c1 = gmsh.model.occ.addCurveLoop(lines)
+    s1 = gmsh.model.occ.addPlaneSurface([c1])
+
+    section = (2, s1)
+    shell = []
+    for index in range(4):
+        v1 = gmsh.model.occ.revolve([section], x, y, z, 0, 0, 1, math.pi / 2, numElements=[max(1, (layers + index) // 4)], recombine=True)
+        section = v1[0]
+        shell += [dimtag for dimtag in v1 if dimtag[0] == 3]
+
+    return inner, shell
+
+# function to sort the outer surfaces of a nested boundary into ground (the plane z = ground_z), space, and the
+# interface between the inner and shell volumes. surfaces of the inner volume that are not on the ground are the
+# spacecraft, so they are left out
+def classifyFarField(inner_volumes, shell_volumes, ground_z):
+
+    inner_surfaces = set()
+    for tag in inner_volumes:
+        inner_surfaces.update(gmsh.model.getAdjacencies(3, tag)[1])
+
+    shell_surfaces = set()
+    between = set() # surfaces between two quarters of the shell, inside the boundary
+    for tag in shell_volumes:
+        surfaces = gmsh.model.getAdjacencies(3, tag)[1]
+        between.update(shell_surfaces.intersection(surfaces))
+        shell_surfaces.update(surfaces)
+
+    interface = inner_surfaces & shell_surfaces
+
+    ground = []
+    space = []
+    for tag in sorted(inner_surfaces | shell_surfaces):
+        if tag in interface or tag in between:
+            continue
+        zmax = gmsh.model.getBoundingBox(2, tag)[5]
+        if abs(zmax - ground_z) < 1e-6:
+            ground.append(tag)
+        elif tag in shell_surfaces:
+            space.append(tag)
+
+    return space, ground, sorted(interface)
+
+if multigrid_levels > 1:
+    gmsh.finalize()
+    sys.exit("multigrid_levels > 1 is not supported: the gaps between the parts (0.05 to 0.1) can't be meshed at the coarse sizes")
+
+# follow the memory and the meshing progress in the background
+startWatch(memory_budget, stage_timeouts, progress_log, print_progress)
 
 
 ######## FUSELAGE ########
 
 bottom = gmsh.model.occ.addCone(0, 0, 0, 0, 0, 2 * height / 5, radius - 0.5, radius)
 top = gmsh.model.occ.addCylinder(0, 0, 2 * height / 5 + tolerance, 0, 0, 3 * height / 5 + tolerance, radius)
+setName([(3, top)], "Fuselage Top", meshsize_upperfuselage)
+setName([(3, bottom)], "Fuselage Bottom", meshsize_lowerfuselage)
 
 
 ######## TANK ########
@@ -60,87 +152,124 @@ for index in range(0,3):
     tank_hole_list.append(gmsh.model.occ.copy([tank_hole_list[-1]])[0])
     gmsh.model.occ.rotate([tank_hole_list[-1]], 0, 0, 0, 0, 0, 1, math.pi/2)
 
-gmsh.model.occ.cut([(3, bottom)], tank_hole_list)
+booleanNamed("cut", [(3, bottom)], tank_hole_list)
 
 tank = gmsh.model.occ.addCylinder(radius - 0.5, 0, 0.5, 0, 0, 2 * height / 5 - 1.5, tank_radius)
+setName([(3, tank)], "Tank 1", meshsize_tanks)
 tank_list = [(3, tank)]
 for index in range(0,3):
-    tank_list.append(gmsh.model.occ.copy([tank_list[-1]])[0])
+    tank_list.append(copyNamed([tank_list[-1]], "Tank " + str(index + 2), meshsize_tanks)[0])
     gmsh.model.occ.rotate([tank_list[-1]], 0, 0, 0, 0, 0, 1, math.pi / 2)
 
 
 ######## LANDING LEGS ########
 
 leg = gmsh.model.occ.addCylinder(radius - 0.2, 0, 2 * height / 5 - 0.2, 2.5, 0, - (2 * height / 5 + 1.87), leg_radius)
+setName([(3, leg)], "Leg 1", meshsize_landinglegs)
 cone = gmsh.model.occ.addCone(0, 0, 0, 0, 0, 2 * height / 5, radius - 0.5 + tolerance, radius + tolerance)
 
-gmsh.model.occ.cut([(3, leg)], [(3, cone)])
-
-leg_list = [(3, leg)]
+leg_list, _ = booleanNamed("cut", [(3, leg)], [(3, cone)])
 gmsh.model.occ.rotate([leg_list[-1]], 0, 0, 0, 0, 0, 1, math.pi / 4)
 
 for index in range(0,3):
-    leg_list.append(gmsh.model.occ.copy([leg_list[-1]])[0])
+    leg_list.append(copyNamed([leg_list[-1]], "Leg " + str(index + 2), meshsize_landinglegs)[0])
     gmsh.model.occ.rotate([leg_list[-1]], 0, 0, 0, 0, 0, 1, math.pi / 2)
 
 
 ######## BOUNDARY & PHYSICAL GROUPS ########
 
-gmsh.model.occ.synchronize()
+# every part's surfaces get its name, and with it a physical group and mesh size after the boundary cut
+nameSurfaces()
 
-# get the surfaces for the two halves of the fuselage and then assign them to physical groups
-_ , bottom_surfaces = gmsh.model.getAdjacencies(3, bottom)
-_ , top_surfaces = gmsh.model.getAdjacencies(3, top)
-ps_top = gmsh.model.addPhysicalGroup(2, top_surfaces, name="Fuselage Top")
-ps_bottom = gmsh.model.addPhysicalGroup(2, bottom_surfaces, name="Fuselage Bottom")
-
-
-# get the surfaces for the tanks and assign them to their own individual physical groups
-i = 0
-ps_tank_list = []
-for volume in tank_list:
-    i = i + 1
-    up, surface_tags = gmsh.model.getAdjacencies(*volume)
-    name = "Tank " + str(i)
-    ps_tank_list.append(gmsh.model.addPhysicalGroup(2, surface_tags, name=name))
-
-# get the surfaces for the landing legs and assign them to their own individual physical groups
-i = 0
-ps_leg_list = []
-for volume in leg_list:
-    i = i + 1
-    up, surface_tags = gmsh.model.getAdjacencies(*volume)
-    name = "Leg " + str(i)
-    ps_leg_list.append(gmsh.model.addPhysicalGroup(2, surface_tags, name=name))
+startPhase("booleans")
 
-gmsh.model.occ.synchronize()
+if check_clearance:
+    too_close = checkClearance(min_clearance)
+    for first, second, distance in too_close:
+        print(first + " and " + second + " are " + str(round(distance, 4)) + " apart")
+    if too_close:
+        gmsh.finalize()
+        sys.exit(str(len(too_close)) + " pairs of physical groups are closer than " + str(min_clearance))
 
-# create cylindrical boundary, assign physical group, and then create physical volume
+# create cylindrical boundary, name its surfaces, and then create the physical groups and volume
 volumes = gmsh.model.occ.getEntities(3)
-boundary = gmsh.model.occ.addCylinder(0, 0, -2.2, 0, 0, boundary_radius, boundary_height)
-gmsh.model.occ.synchronize()
 
-_ , boundary_surfaces = gmsh.model.getAdjacencies(3, boundary)
-gmsh.model.occ.cut([(3, boundary)], volumes)
-gmsh.model.occ.synchronize()
+if nested_far_field:
+    inner, shell = addNestedBoundary(0, 0, -2.2, boundary_radius, boundary_height, inner_boundary_height, inner_boundary_radius, far_field_layers)
+    # the shell goes on before the lander is cut out, a fragment afterwards would give the lander surfaces new tags
+    _, out_map = booleanNamed("fragment", [(3, inner)], shell)
+    inner_pieces, _ = booleanNamed("cut", out_map[0], volumes)
+    gmsh.model.occ.synchronize()
+
+    inner_volumes = [tag for _, tag in inner_pieces]
+    shell_volumes = [tag for item in out_map[1:] for _, tag in item]
+    space_surfaces, ground_surfaces, interface_surfaces = classifyFarField(inner_volumes, shell_volumes, -2.2)
+
+    setName([(2, tag) for tag in ground_surfaces], "Ground")
+    setName([(2, tag) for tag in space_surfaces], "Space")
+    boundary_volumes = [*inner_volumes, *shell_volumes]
+else:
+    boundary = gmsh.model.occ.addCylinder(0, 0, -2.2, 0, 0, boundary_radius, boundary_height)
+    gmsh.model.occ.synchronize()
+
+    # the ground is the bottom of the cylinder, and the rest of it is space
+    boundary_surfaces = gmsh.model.getBoundary([(3, boundary)], combined=False, oriented=False)
+    ground_surfaces = [surface for surface in boundary_surfaces if gmsh.model.getBoundingBox(*surface)[5] < -2.2 + tolerance]
+    setName(ground_surfaces, "Ground")
+    setName([surface for surface in boundary_surfaces if surface not in ground_surfaces], "Space")
+
+    booleanNamed("cut", [(3, boundary)], volumes)
+    boundary_volumes = [boundary]
 
-ps_ground = gmsh.model.addPhysicalGroup(2, [boundary_surfaces[2]], name="Ground")
-ps_space = gmsh.model.addPhysicalGroup(2, [boundary_surfaces[0], boundary_surfaces[1]], name="Space")
-pv = gmsh.model.addPhysicalGroup(3, [boundary], name="Volume")
+groups = addNamedGroups()
+ps_ground = groups["Ground"]
+ps_space = groups["Space"]
+pv = gmsh.model.addPhysicalGroup(3, boundary_volumes, name="Volume")
 
-# assign the proper mesh sizes for every physical group.
+# assign the mesh sizes of the far field, the parts got theirs with their names.
 # NOTE: since cylinders have 3 surfaces but are only defined by 2 points, changing the mesh size for ps_space 
 # also changes it for ps_ground. to have a different mesh size for ps_ground it has to be set after the mesh 
 # size for ps_space is set.
-setMeshSize(ps_bottom, meshsize_lowerfuselage)
-setMeshSize(ps_top, meshsize_upperfuselage)
 setMeshSize(ps_space, meshsize_space) 
 setMeshSize(ps_ground, meshsize_ground)
-[setMeshSize(item, meshsize_tanks) for item in ps_tank_list]
-[setMeshSize(item, meshsize_landinglegs) for item in ps_leg_list]
+
+if nested_far_field:
+    interface_points = gmsh.model.getBoundary([(2, tag) for tag in interface_surfaces], combined=False, recursive=True)
+    gmsh.model.mesh.setSize(interface_points, meshsize_interface)
+
+if curvature_sizing:
+    setCurvatureSizing(curvature_sizing, curvature_points, curvature_clamp)
+
+if cost_report:
+    writeCostReport("blue_moon")
+
+startPhase("2D")
+
+if preview:
+    empty = writePreview("blue_moon", [ps_space, ps_ground])
+    printMemoryReport()
+    gmsh.finalize()
+    if empty:
+        sys.exit("empty physical groups: " + ", ".join(empty))
+    sys.exit()
 
 gmsh.model.occ.synchronize()
 gmsh.option.setNumber("Mesh.MshFileVersion", 2.2) # save msh in ASCII 2 format
-gmsh.model.mesh.generate(3)
-gmsh.write("blue_moon.msh") # write .msh file 
-#gmsh.write("moon.brep") # save .brep file
\ No newline at end of file
+if multigrid_levels > 1:
+    gmsh.option.setNumber("Mesh.MeshSizeFactor", 2 ** (multigrid_levels - 1)) # coarsest level, each refinement halves the sizes
+if surface_checkpoint:
+    meshSurfacesWithCheckpoint("blue_moon", [ps_space, ps_ground])
+else:
+    gmsh.model.mesh.generate(2)
+startPhase("3D")
+meshVolumes() # only meshes the volume, the surfaces already are
+startPhase("write")
+if multigrid_levels > 1:
+    writeMultigridHierarchy("blue_moon", multigrid_levels) # blue_moon_0.msh, blue_moon_1.msh + blue_moon_1.transfer, ...
+else:
+    if renumbering:
+        renumberMesh(renumbering)
+    gmsh.write("blue_moon.msh") # write .msh file 
+#gmsh.write("moon.brep") # save .brep file
+writeRotatedMeshes("blue_moon", [0, 0, 1], sweep_angles) # the boundary cylinder is centered on the z axis
+printMemoryReport()
\ No newline at end of file
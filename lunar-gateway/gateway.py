@@ -1,34 +1,140 @@
 import gmsh
+import multiprocessing
+import os
+import sys
 import math
-
-def setMeshSize(physical_group, mesh_size):
-    # function to set the mesh size of surfaces from its physical group tag
-    
-    gmsh.model.occ.synchronize()
-
-    # gets the lines that make up each physical surface, and then the points that make up each of those lines
-    points = []
-    for tag in gmsh.model.getEntitiesForPhysicalGroup(2, physical_group):
-        _, line = gmsh.model.getAdjacencies(2, tag)
-        for i in line:
-            _, pts = gmsh.model.getAdjacencies(1, i)
-            points.append(pts)
-    
-    points = list(set([item for sublist in points for item in sublist])) # flatten and filter out any duplicate points in tag list
-
-    # change the formatting to be (dim, tag) list
-    entities = []
-    for tag in points:
-        entities.append((0, tag))
-    
-    gmsh.model.mesh.setSize(entities, mesh_size)
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # mesh_tools.py is one folder up
+import mesh_tools
+from mesh_tools import (setMeshSize, group_sizes, setCurvatureSizing, setName, copyNamed, booleanNamed, nameSurfaces,
+    addNamedGroups, entity_names, name_sizes, named_groups, writeMultigridHierarchy, writePreview, getSurfaceClosure,
+    getEntityMeshes, addEntityMeshes, meshSurfacesWithCheckpoint, meshVolumes, checkClearance, writeRotatedMeshes,
+    renumberMesh, writeCostReport, startPhase, printMemoryReport, startWatch, progress_lock)
+
+def addNestedBoundary(x, y, z, r, inner_r, layers):
+    # function to build the boundary as an inner sphere (meshed with tets) nested inside an outer shell. the shell
+    # is made by revolving its half annulus cross section around the z axis, so it gets meshed as layers of prisms
+    # that are conformal with the surface of the inner sphere. gmsh only extrudes a mesh by revolution for angles
+    # below 2*pi, so the shell is revolved in quarters, and the inner sphere is fused from quarters with their faces
+    # left apart (the prisms don't match a whole sphere, whose surface is one periodic face). returns the inner
+    # volume and the shell volumes
+
+    quarters = []
+    for index in range(4):
+        quarters.append((3, gmsh.model.occ.addSphere(x, y, z, inner_r, angle3=math.pi / 2)))
+        gmsh.model.occ.rotate([quarters[-1]], x, y, z, 0, 0, 1, index * math.pi / 2)
+
+    unify = gmsh.option.getNumber("Geometry.OCCUnionUnify")
+    gmsh.option.setNumber("Geometry.OCCUnionUnify", 0)
+    inner = gmsh.model.occ.fuse(quarters[:1], quarters[1:])[0][0][1]
+    gmsh.option.setNumber("Geometry.OCCUnionUnify", unify)
+
+    # cross section of the shell in the xz plane, split into quarter arcs
+    center = gmsh.model.occ.addPoint(x, y, z)
+    arcs = []
+    for radius in [inner_r, r]:
+        p1 = gmsh.model.occ.addPoint(x, y, z - radius)
+        p2 = gmsh.model.occ.addPoint(x + radius, y, z)
+        p3 = gmsh.model.occ.addPoint(x, y, z + radius)
+        arcs.append([p1, p3, gmsh.model.occ.addCircleArc(p1, center, p2), gmsh.model.occ.addCircleArc(p2, center, p3)])
+
+    inner_arc, outer_arc = arcs
+    l1 = gmsh.model.occ.addLine(outer_arc[0], inner_arc[0])
+    l2 = gmsh.model.occ.addLine(inner_arc[1], outer_arc[1])
+    c1 = gmsh.model.occ.addCurveLoop([l1, inner_arc[2], inner_arc[3], l2, -outer_arc[3], -outer_arc[2]])
+    s1 = gmsh.model.occ.addPlaneSurface([c1])
+    gmsh.model.occ.remove([(0, center)])
+
+    section = (2, s1)
+    shell = []
+    for index in range(4):
+        v1 = gmsh.model.occ.revolve([section], x, y, z, 0, 0, 1, math.pi / 2, numElements=[max(1, (layers + index) // 4)], recombine=True)
+        section = v1[0]
+        shell += [dimtag for dimtag in v1 if dimtag[0] == 3]
+
+    return inner, shell
+
+def classifyFarField(inner_volumes, shell_volumes):
+    # function to sort the surfaces of a nested boundary into space and the interface between the inner and shell
+    # volumes. the other surfaces of the inner volume are the station, so they are left out
+
+    inner_surfaces = set()
+    for tag in inner_volumes:
+        inner_surfaces.update(gmsh.model.getAdjacencies(3, tag)[1])
+
+    shell_surfaces = set()
+    between = set() # surfaces between two quarters of the shell, inside the boundary
+    for tag in shell_volumes:
+        surfaces = gmsh.model.getAdjacencies(3, tag)[1]
+        between.update(shell_surfaces.intersection(surfaces))
+        shell_surfaces.update(surfaces)
+
+    interface = inner_surfaces & shell_surfaces
+    space = shell_surfaces - interface - between
+
+    return sorted(space), sorted(interface)
+
+def meshSurfaces(surfaces):
+    # function run in a worker process forked from the main one, so it starts with the whole model. meshes only the
+    # given surfaces with their curves and points, and returns the nodes and elements of each of those entities
+
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 1)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 0)
+    gmsh.model.setVisibility([(2, tag) for tag in surfaces], 1, recursive=True)
+    gmsh.model.mesh.generate(2)
+
+    return getEntityMeshes(getSurfaceClosure(surfaces))
+
+def meshSurfacesInParallel(jobs, workers):
+    # function to mesh each list of surfaces in jobs in its own worker process, and add the results to the model.
+    # the surfaces of different jobs can't share curves, so that their boundary discretizations match. every worker
+    # numbers its nodes and elements from 1, so each result is shifted past the ones added before it
+
+    # the workers are forked while the watcher thread is paused between two polls (see watchBuild)
+    with progress_lock:
+        pool = multiprocessing.get_context("fork").Pool(workers)
+    with pool:
+        results = pool.map(meshSurfaces, jobs)
+
+    node_offset = 0
+    element_offset = 0
+    for meshes in results:
+        max_node, max_element = addEntityMeshes(meshes, node_offset, element_offset)
+        node_offset += max_node
+        element_offset += max_element
 
 
 # GLOBAL VARIABLES
 
 tol = 0.01 # the spacing between different physical groups
+check_clearance = True # stop before the boolean cut if two physical groups are closer than min_clearance
+min_clearance = 0.5 * tol
+cost_report = False # estimate the elements that thin features and narrow gaps cost, ranked in gateway_cost.txt
 boundary_radius = 85
 
+nested_far_field = False # split the boundary into a refined inner sphere and a coarse outer shell of prism layers
+inner_boundary_radius = 30 # radius of the inner sphere
+far_field_layers = 48 # number of prism layers around the z axis in the outer shell
+ms_interface = 0.05 * boundary_radius # mesh size on the surface between the inner sphere and the outer shell
+
+renumbering = None # "RCMK" or "Hilbert" to reorder the nodes and elements for solver locality (not with multigrid)
+sweep_axis = [0, 0, 1] # axis for the orientation sweep, any axis works since the boundary is a sphere
+sweep_angles = [] # also write the mesh rotated about sweep_axis by each of these angles (degrees)
+multigrid_levels = 1 # write this many nested meshes for multigrid, the finest one is meshed at the normal sizes
+curvature_sizing = None # "replace" or "add" to size the mesh from the curvature of the surfaces, instead of or on top of the sizes above
+curvature_points = 20 # elements per 2 pi of curvature
+curvature_clamp = (0.25, 1) # the curvature sizes are kept between these factors of the mesh size of each physical group
+preview = False # only mesh the surfaces and write gateway_preview.stl, to check the geometry quickly
+surface_checkpoint = False # reuse the spacecraft surface mesh saved in gateway_surface.ckpt when only the far field changed
+memory_budget = 0 # abort the build if it uses more than this many MB of memory (0 for no limit)
+stage_timeouts = {"2D": 0, "3D": 0} # abort a meshing stage if it takes longer than this many seconds (0 for no limit)
+progress_log = None # file to append the meshing progress to
+print_progress = False # print every curve, surface and volume as it starts meshing
+surface_workers = 1 # mesh the surfaces of each module in this many parallel processes, then only the volume in this one (not with surface_checkpoint)
+scaling_counts = [] # instead of the station, time synthetic stations of these numbers of modules (e.g. [1, 2, 4, 8, 16, 32, 64])
+scaling_size_factor = 4 # mesh size factor for the synthetic stations, to keep the big ones quick
+
 docking_radius = 1.3 / 2 # these are used across almost every module so its global
 docking_length = 0.17
 
@@ -59,39 +165,23 @@ def ppe(a, b, c):
     a = a - width/2
     c = c - depth/2
 
-    # geometry 
+    # geometry (the physical groups and mesh sizes follow from the names)
     module = gmsh.model.occ.addBox(a, b, c, width, height, depth)
+    setName([(3, module)], "PPE", ms_module)
 
     arm1 = gmsh.model.occ.addBox(a + width/2 - arm_length/2, b + height/2 - arm_length/2, c, arm_length, arm_length, -arm_protrusion)
     arm2 = gmsh.model.occ.copy([(3,arm1)])
     gmsh.model.occ.rotate(arm2, a + width/2, b, c + depth/2, 0, 1, 0, math.pi)
 
     cyl1 = gmsh.model.occ.addCylinder(a + width/2, b + height, c + depth/2 , 0, docking_length, 0, docking_radius)
-    gmsh.model.occ.fuse([(3,module)], [(3, arm1), *arm2, (3, cyl1)])
+    booleanNamed("fuse", [(3,module)], [(3, arm1), *arm2, (3, cyl1)])
 
     panel1 = gmsh.model.occ.addBox(a + width/2 - arm_length/2, b + height/2 - panel_width/2, c - arm_protrusion - tol, arm_length,  panel_width, -panel_protrusion)
-    panel2 = gmsh.model.occ.copy([(3,panel1)])
+    setName([(3, panel1)], "PPE Panel 1", ms_panel)
+    panel2 = copyNamed([(3,panel1)], "PPE Panel 2", ms_panel)
     gmsh.model.occ.rotate(panel2, a + width/2, b, c + depth/2, 0, 1, 0, math.pi)
 
 
-    # physical grouping
-    gmsh.model.occ.synchronize()
-
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_ppe = gmsh.model.addPhysicalGroup(2, module_tags, name="PPE")
-    
-    _, panel1_tags = gmsh.model.getAdjacencies(3, panel1)
-    ps_ppe_sp1 = gmsh.model.addPhysicalGroup(2, panel1_tags, name="PPE Panel 1")
-    
-    _, panel2_tags = gmsh.model.getAdjacencies(3, panel2[0][1])
-    ps_ppe_sp2 = gmsh.model.addPhysicalGroup(2, panel2_tags, name="PPE Panel 2")
-
-
-    # mesh sizes
-    setMeshSize(ps_ppe, ms_module)
-    setMeshSize(ps_ppe_sp1, ms_panel)
-    setMeshSize(ps_ppe_sp2, ms_panel)
-    
     global dim_ppe  
     dim_ppe = [height + docking_length]
 
@@ -109,6 +199,7 @@ def halo(a, b, c):
 
     b = b + docking_length
     module = gmsh.model.occ.addCylinder(a, b + slope_length, c, 0, length - 2 * slope_length, 0, radius)
+    setName([(3, module)], "HALO", ms_halo)
     cone1 = gmsh.model.occ.addCone(a, b, c, 0, slope_length, 0, docking_radius, radius)
     cone2 = gmsh.model.occ.addCone(a, b + length - slope_length, c, 0, slope_length, 0, radius, docking_radius)
     cyl1 = gmsh.model.occ.addCylinder(a, b, c, 0, -docking_length, 0, docking_radius)
@@ -116,15 +207,7 @@ def halo(a, b, c):
     cyl3 = gmsh.model.occ.addCylinder(a, b+length/2, c, radius + 2 * docking_length, 0, 0, docking_radius)
     cyl4 = gmsh.model.occ.addCylinder(a, b+length/2, c, -(radius + 2 * docking_length), 0, 0, docking_radius)
 
-    gmsh.model.occ.fuse([(3, module)], [(3, cone1), (3, cone2), (3,cyl1), (3,cyl2), (3,cyl3), (3,cyl4)])
-
-    gmsh.model.occ.synchronize()
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_halo = gmsh.model.addPhysicalGroup(2, module_tags, name="HALO")
-
-    
-
-    setMeshSize(ps_halo, ms_halo)
+    booleanNamed("fuse", [(3, module)], [(3, cone1), (3, cone2), (3,cyl1), (3,cyl2), (3,cyl3), (3,cyl4)])
 
     global dim_halo
     dim_halo = [length + 2 * docking_length, radius + 2 * docking_length, length / 2 + docking_length]
@@ -148,6 +231,7 @@ def ihab(a, b, c):
     b = b + docking_length
 
     module = gmsh.model.occ.addCylinder(a, b, c, 0, length, 0, radius)
+    setName([(3, module)], "I-HAB", ms_ihab)
     cyl1 = gmsh.model.occ.addCylinder(a, b, c, 0, -docking_length, 0, docking_radius)
     cyl2 = gmsh.model.occ.addCylinder(a, b + length, c, 0, docking_length, 0, docking_radius)
     cyl3 = gmsh.model.occ.addCylinder(a, b+length/2, c, radius + 2 * docking_length, 0, 0, docking_radius)
@@ -157,27 +241,13 @@ def ihab(a, b, c):
     arm2 = gmsh.model.occ.copy([(3, arm1)])
     gmsh.model.occ.rotate(arm2, a, b, c, 0, 1, 0, math.pi)
 
-    gmsh.model.occ.fuse([(3, module)], [(3,cyl1), (3,cyl2), (3,cyl3), (3,cyl4), (3, arm1), *arm2])
+    booleanNamed("fuse", [(3, module)], [(3,cyl1), (3,cyl2), (3,cyl3), (3,cyl4), (3, arm1), *arm2])
 
     panel1 = gmsh.model.occ.addBox(a - arm_length/2, b + 3/4*length - panel_width/2, c + tol + radius + arm_protrusion, arm_length,  panel_width, panel_protrusion)
-    panel2 = gmsh.model.occ.copy([(3, panel1)])
+    setName([(3, panel1)], "I-HAB Panel 1", ms_panel)
+    panel2 = copyNamed([(3, panel1)], "I-HAB Panel 2", ms_panel)
     gmsh.model.occ.rotate(panel2, a, b, c, 0, 1, 0, math.pi)
 
-
-    gmsh.model.occ.synchronize()
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_ihab = gmsh.model.addPhysicalGroup(2, module_tags, name="I-HAB")
-
-    _, panel1_tags = gmsh.model.getAdjacencies(3, panel1)
-    ps_ihab_sp1 = gmsh.model.addPhysicalGroup(2, panel1_tags, name="I-HAB Panel 1")
-    
-    _, panel2_tags = gmsh.model.getAdjacencies(3, panel2[0][1])
-    ps_ihab_sp2 = gmsh.model.addPhysicalGroup(2, panel2_tags, name="I-HAB Panel 2")
-
-    setMeshSize(ps_ihab, ms_ihab)
-    setMeshSize(ps_ihab_sp1, ms_panel)
-    setMeshSize(ps_ihab_sp2, ms_panel)
-
     global dim_ihab
     dim_ihab = [length + 2 * docking_length, radius + 2 * docking_length, length / 2 + docking_length]
 
@@ -204,6 +274,7 @@ def orion(a, b, c):
     ms_panel = 0.1 * panel_protrusion
 
     module = gmsh.model.occ.addCylinder(a, b, c, 0, 2 * docking_length, 0, docking_radius)
+    setName([(3, module)], "Orion", ms_orion)
     cyl1 = gmsh.model.occ.addCone(a, b + 2 * docking_length, c, 0, crew_length, 0, docking_radius, crew_radius)
     cyl2 = gmsh.model.occ.addCylinder(a, b + 2 * docking_length + crew_length, c, 0, service_length, 0, service_radius)
     cyl3 = gmsh.model.occ.addCylinder(a, b + 2 * docking_length + crew_length - heatshield_thickness/2, c, 0, heatshield_thickness, 0, crew_radius)
@@ -221,43 +292,22 @@ def orion(a, b, c):
     arm4 = gmsh.model.occ.copy(arm3)
     gmsh.model.occ.rotate(arm4, a, b, c, 0, 1, 0, math.pi)
 
-    gmsh.model.occ.fuse([(3, module)], [(3,cyl1), (3,cyl2), (3,cyl3), (3,cyl4), (3, arm1), *arm2, *arm3, *arm4])
+    booleanNamed("fuse", [(3, module)], [(3,cyl1), (3,cyl2), (3,cyl3), (3,cyl4), (3, arm1), *arm2, *arm3, *arm4])
 
     panel1 = gmsh.model.occ.addBox(a - arm_length/2, b + crew_length + 7/8 * service_length - panel_width/2, c + service_radius + tol + arm_protrusion, arm_length,  panel_width, panel_protrusion)
     gmsh.model.occ.rotate([(3, panel1)], a, b + crew_length + 7/8 * service_length, c + service_radius + tol + arm_protrusion, 0, 0, 1, math.pi/2)
     gmsh.model.occ.rotate([(3, panel1)], a, b, c, 0, 1, 0, math.pi/3)
+    setName([(3, panel1)], "Orion Panel 1", ms_panel)
 
-    panel2 = gmsh.model.occ.copy([(3, panel1)])
+    panel2 = copyNamed([(3, panel1)], "Orion Panel 2", ms_panel)
     gmsh.model.occ.rotate(panel2, a, b, c, 0, 1, 0, math.pi)
 
-    panel3 = gmsh.model.occ.copy([(3, panel1)])
+    panel3 = copyNamed([(3, panel1)], "Orion Panel 3", ms_panel)
     gmsh.model.occ.rotate(panel3, a, b, c, 0, 1, 0, 4 * math.pi/3)
     
-    panel4 = gmsh.model.occ.copy(panel3)
+    panel4 = copyNamed(panel3, "Orion Panel 4", ms_panel)
     gmsh.model.occ.rotate(panel4, a, b, c, 0, 1, 0, math.pi)
 
-    gmsh.model.occ.synchronize()
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_orion = gmsh.model.addPhysicalGroup(2, module_tags, name="Orion")
-
-    _, panel1_tags = gmsh.model.getAdjacencies(3, panel1)
-    ps_orion_sp1 = gmsh.model.addPhysicalGroup(2, panel1_tags, name="Orion Panel 1")
-    
-    _, panel2_tags = gmsh.model.getAdjacencies(3, panel2[0][1])
-    ps_orion_sp2 = gmsh.model.addPhysicalGroup(2, panel2_tags, name="Orion Panel 2")
-    
-    _, panel3_tags = gmsh.model.getAdjacencies(3, panel3[0][1])
-    ps_orion_sp3 = gmsh.model.addPhysicalGroup(2, panel3_tags, name="Orion Panel 3")
-
-    _, panel4_tags = gmsh.model.getAdjacencies(3, panel4[0][1])
-    ps_orion_sp4 = gmsh.model.addPhysicalGroup(2, panel4_tags, name="Orion Panel 4")
-
-    setMeshSize(ps_orion, ms_orion)
-    setMeshSize(ps_orion_sp1, ms_panel)
-    setMeshSize(ps_orion_sp2, ms_panel)
-    setMeshSize(ps_orion_sp3, ms_panel)
-    setMeshSize(ps_orion_sp4, ms_panel)
-
     global dim_orion
     dim_orion = [2 * docking_length + crew_length + service_length]
 
@@ -272,6 +322,7 @@ def esprit(a, b, c):
     ms_esprit = 0.1 * smaller_radius
 
     module = gmsh.model.occ.addCylinder(a, b, c, 2* docking_length, 0, 0, docking_radius)
+    setName([(3, module)], "ESPRIT", ms_esprit)
 
     points = [(0, gmsh.model.occ.addPoint(a + 2*docking_length, b, c + radius))]
     
@@ -291,16 +342,10 @@ def esprit(a, b, c):
     cyl1 = gmsh.model.occ.addCylinder(a + 2 * docking_length + hex_length, b, c, length - hex_length - 3 * docking_length, 0, 0, smaller_radius)
     cyl2 = gmsh.model.occ.addCylinder(a + length - docking_length, b, c, docking_length, 0, 0, docking_radius)
     
-    gmsh.model.occ.fuse([(3, module)], [hex, (3, cyl1), (3, cyl2)])
+    booleanNamed("fuse", [(3, module)], [hex, (3, cyl1), (3, cyl2)])
 
     gmsh.model.occ.rotate([(3, module)], a, b, c, 0, 0, 1, math.pi)
 
-    gmsh.model.occ.synchronize()
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_esprit = gmsh.model.addPhysicalGroup(2, module_tags, name="ESPRIT")
-
-    setMeshSize(ps_esprit, ms_esprit)
-
     global dim_esprit
     dim_esprit = [length + docking_length]
 
@@ -327,10 +372,12 @@ def bluemoon(a, b, c):
 
     bottom = gmsh.model.occ.addCone(a, b, c, 0, 0, 2 * height / 5, radius - 0.5, radius)
     top = gmsh.model.occ.addCylinder(a, b, c+ 2 * height / 5 + tol, 0, 0, 3 * height / 5 + tol, radius)
+    setName([(3, top)], "Blue Moon Fuselage Top", meshsize_upperfuselage)
+    setName([(3, bottom)], "Blue Moon Fuselage Bottom", meshsize_lowerfuselage)
 
     cyl1 = gmsh.model.occ.addCylinder(a, b, c + height + 2 * tol, 0, 0, docking_length, docking_radius)
 
-    gmsh.model.occ.fuse([(3, top)], [(3, cyl1)])
+    booleanNamed("fuse", [(3, top)], [(3, cyl1)])
 
     ######## TANK ########
 
@@ -341,40 +388,18 @@ def bluemoon(a, b, c):
         tank_hole_list.append(gmsh.model.occ.copy([tank_hole_list[-1]])[0])
         gmsh.model.occ.rotate([tank_hole_list[-1]], a, b, c, 0, 0, 1, math.pi/2)
 
-    gmsh.model.occ.cut([(3, bottom)], tank_hole_list)
+    booleanNamed("cut", [(3, bottom)], tank_hole_list)
 
     tank = gmsh.model.occ.addCylinder(a + radius - 0.5, b , c + 0.5, 0, 0, 2 * height / 5 - 1.5, tank_radius)
+    setName([(3, tank)], "Blue Moon Tank 1", meshsize_tanks)
     tank_list = [(3, tank)]
     for index in range(0,3):
-        tank_list.append(gmsh.model.occ.copy([tank_list[-1]])[0])
+        tank_list.append(copyNamed([tank_list[-1]], "Blue Moon Tank " + str(index + 2), meshsize_tanks)[0])
         gmsh.model.occ.rotate([tank_list[-1]], a, b, c, 0, 0, 1, math.pi / 2)
 
 
 
     gmsh.model.occ.rotate([*tank_list, (3, bottom), (3, top)], a, b, c + height + docking_length + 2 * tol, 0, 1, 0, -math.pi/2)
-
-    ######## BOUNDARY & PHYSICAL GROUPS ########
-
-    gmsh.model.occ.synchronize()
-
-    # get the surfaces for the two halves of the fuselage and then assign them to physical groups
-    _ , bottom_surfaces = gmsh.model.getAdjacencies(3, bottom)
-    _ , top_surfaces = gmsh.model.getAdjacencies(3, top)
-    ps_top = gmsh.model.addPhysicalGroup(2, top_surfaces, name="Blue Moon Fuselage Top")
-    ps_bottom = gmsh.model.addPhysicalGroup(2, bottom_surfaces, name="Blue Moon Fuselage Bottom")
-
-    # get the surfaces for the tanks and assign them to their own individual physical groups
-    i = 0
-    ps_tank_list = []
-    for volume in tank_list:
-        i = i + 1
-        _, surface_tags = gmsh.model.getAdjacencies(*volume)
-        name = "Blue Moon Tank " + str(i)
-        ps_tank_list.append(gmsh.model.addPhysicalGroup(2, surface_tags, name=name))
-
-    setMeshSize(ps_bottom, meshsize_lowerfuselage)
-    setMeshSize(ps_top, meshsize_upperfuselage)
-    [setMeshSize(item, meshsize_tanks) for item in ps_tank_list]
     
     return [*tank_list, (3, bottom), (3, top)]
 
@@ -397,6 +422,7 @@ def dragonxl(a, b, c):
     ms_panel = 0.1 * panel_protrusion
 
     module = gmsh.model.occ.addCylinder(a, b + slope_length, c, 0, length - 2 * slope_length - back_length, 0, radius)
+    setName([(3, module)], "Dragon XL", ms_dragonxl)
     cyl1 = gmsh.model.occ.addCylinder(a, b, c, 0, -docking_length, 0, docking_radius)
     cyl2 = gmsh.model.occ.addCylinder(a, b+ length - 2 * slope_length - back_length, c, 0, back_length, 0, back_radius)
     cone1 = gmsh.model.occ.addCone(a, b, c, 0, slope_length, 0, docking_radius, radius)
@@ -406,32 +432,16 @@ def dragonxl(a, b, c):
     arm2 = gmsh.model.occ.copy([(3, arm1)])
     gmsh.model.occ.rotate(arm2, a, b, c, 0, 1, 0, math.pi)
 
-    gmsh.model.occ.fuse([(3, module)], [(3, cone1), (3, cyl1), (3, cyl2), (3, arm1), *arm2])
+    booleanNamed("fuse", [(3, module)], [(3, cone1), (3, cyl1), (3, cyl2), (3, arm1), *arm2])
 
     panel1 = gmsh.model.occ.addBox(a - panel_width/2, b + length - back_length + 1/2 * back_length - arm_length/2, c + tol + back_radius + arm_protrusion, panel_width, arm_length, panel_protrusion)
-    panel2 = gmsh.model.occ.copy([(3, panel1)])
+    setName([(3, panel1)], "Dragon XL Panel 1", ms_panel)
+    panel2 = copyNamed([(3, panel1)], "Dragon XL Panel 2", ms_panel)
     gmsh.model.occ.rotate(panel2, a, b, c, 0, 1, 0, math.pi)
     
 
     gmsh.model.occ.rotate([(3, module), (3, panel1), *panel2], a, b, c, 0, 0, 1, math.pi/2)
 
-    gmsh.model.occ.synchronize()
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_dragonxl = gmsh.model.addPhysicalGroup(2, module_tags, name="Dragon XL")
-
-    _, panel1_tags = gmsh.model.getAdjacencies(3, panel1)
-    ps_dragonxl_sp1 = gmsh.model.addPhysicalGroup(2, panel1_tags, name="Dragon XL Panel 1")
-    
-    _, panel2_tags = gmsh.model.getAdjacencies(3, panel2[0][1])
-    ps_dragonxl_sp2 = gmsh.model.addPhysicalGroup(2, panel2_tags, name="Dragon XL Panel 2")
-
-    
-
-    setMeshSize(ps_dragonxl, ms_dragonxl)
-    setMeshSize(ps_dragonxl_sp1, ms_panel)
-    setMeshSize(ps_dragonxl_sp2, ms_panel)
-
-
     return [(3, module), (3, panel1), *panel2]
 
 def airlock(a, b, c):
@@ -441,25 +451,144 @@ def airlock(a, b, c):
     ms_airlock = 0.1 * radius
     
     module = gmsh.model.occ.addCylinder(a, b, c, 0, docking_length, 0, docking_radius)
+    setName([(3, module)], "Airlock", ms_airlock)
     cyl1 = gmsh.model.occ.addCylinder(a, b + docking_length, c, 0, length, 0, radius)
 
-    gmsh.model.occ.fuse([(3, module)], [(3, cyl1)])
+    booleanNamed("fuse", [(3, module)], [(3, cyl1)])
 
     gmsh.model.occ.rotate([(3, module)], a, b, c, 0, 0, 1, math.pi/2)
 
-    gmsh.model.occ.synchronize()
-    _, module_tags = gmsh.model.getAdjacencies(3, module)
-    ps_airlock = gmsh.model.addPhysicalGroup(2, module_tags, name="Airlock")
+    return [(3, module)]
 
-    setMeshSize(ps_airlock, ms_airlock)
 
-    return [(3, module)]
+# SCALING HARNESS
+
+def addModuleChain(count):
+    # function to build a synthetic station of count modules: halo, ihab and airlock repeated, with the halos and ihabs
+    # docked end to end along y and every airlock docked to the side port of the ihab before it. returns the volumes
+    # and the length of the station
+
+    volumes = []
+    b = 0
+    for i in range(count):
+        if i % 3 == 0:
+            volumes += halo(0, b, 0)
+            b += dim_halo[0] + tol
+        elif i % 3 == 1:
+            ihab_b = b
+            volumes += ihab(0, b, 0)
+            b += dim_ihab[0] + tol
+        else:
+            volumes += airlock(-(dim_ihab[1] + tol), ihab_b + dim_ihab[2], 0)
+
+    return volumes, b - tol
+
+def getScalingExponent(counts, times):
+    # function to fit the exponent k of time ~ n^k, by least squares on log-log scale
+
+    x = [math.log(n) for n in counts]
+    y = [math.log(max(t, 1e-6)) for t in times]
+    x_mean = sum(x) / len(x)
+    y_mean = sum(y) / len(y)
+
+    variance = sum((xi - x_mean) ** 2 for xi in x)
+    if variance == 0:
+        return 0
+    return sum((xi - x_mean) * (yi - y_mean) for xi, yi in zip(x, y)) / variance
+
+def runScalingHarness(counts, size_factor):
+    # function to time every phase of the build (geometry, sizing, booleans, 2D, 3D) on synthetic stations of each
+    # number of modules in counts, each in a sphere that grows with the station, and fit how each phase scales. a phase
+    # is superlinear from the first number of modules where its local exponent (from the run before) goes over 1.2,
+    # and the phase that gets there with the fewest modules is the first to look at. prints the results and writes
+    # them to gateway_scaling.txt
+
+    stages = ["geometry", "sizing", "booleans", "2D", "3D"]
+    counts = sorted(counts)
+    times = {stage: [] for stage in stages}
+    lines = ["modules " + " ".join(stage.rjust(9) for stage in stages) + "  elements"]
+
+    for count in counts:
+        gmsh.clear()
+        group_sizes.clear()
+        entity_names.clear()
+        name_sizes.clear()
+        named_groups.clear()
+        gmsh.option.setNumber("Mesh.MeshSizeFactor", size_factor)
+        mesh_tools.sizing_time = 0
+
+        start = time.time()
+        volumes, length = addModuleChain(count)
+        nameSurfaces()
+        addNamedGroups()
+        times["geometry"].append(time.time() - start - mesh_tools.sizing_time)
+
+        start = time.time()
+        radius = max(boundary_radius, length)
+        boundary = gmsh.model.occ.addSphere(0, length / 2, 0, radius)
+        gmsh.model.occ.synchronize()
+        setName(gmsh.model.getBoundary([(3, boundary)], combined=False, oriented=False), "Space")
+        booleanNamed("cut", [(3, boundary)], volumes)
+        ps_space = addNamedGroups()["Space"]
+        gmsh.model.addPhysicalGroup(3, [boundary], name="Volume")
+        times["booleans"].append(time.time() - start)
+
+        setMeshSize(ps_space, 0.1 * radius)
+        times["sizing"].append(mesh_tools.sizing_time)
+
+        start = time.time()
+        gmsh.model.mesh.generate(2)
+        times["2D"].append(time.time() - start)
+
+        start = time.time()
+        gmsh.model.mesh.generate(3)
+        times["3D"].append(time.time() - start)
+
+        elements = sum(len(tags) for tags in gmsh.model.mesh.getElements(3)[1])
+        lines.append(str(count).rjust(7) + " " + " ".join(str(round(times[stage][-1], 3)).rjust(9) for stage in stages) + "  " + str(elements).rjust(8))
+        print(lines[-1])
+
+    lines.append("")
+    first = None
+    for stage in stages:
+        superlinear = None
+        for i in range(1, len(counts)):
+            if getScalingExponent(counts[i - 1:i + 1], times[stage][i - 1:i + 1]) > 1.2:
+                superlinear = counts[i]
+                break
+        line = stage + ": time ~ n^" + str(round(getScalingExponent(counts, times[stage]), 2))
+        if superlinear:
+            line += ", superlinear from " + str(superlinear) + " modules"
+            if first is None or superlinear < first[1]:
+                first = (stage, superlinear)
+        lines.append(line)
+    if first:
+        lines.append("first superlinear phase: " + first[0] + " (" + str(first[1]) + " modules)")
+
+    for line in lines[len(counts) + 1:]:
+        print(line)
+    with open("gateway_scaling.txt", "w") as f:
+        f.write("\n".join(lines) + "\n")
 
 
 # CREATE GEOMETRY
 
 gmsh.initialize()
 
+# the checkpoint meshes all the surfaces in this process when it has to remesh, so it would quietly drop the workers
+if surface_checkpoint and surface_workers > 1:
+    gmsh.finalize()
+    sys.exit("surface_checkpoint and surface_workers > 1 can't be used together, set one of them off")
+
+# follow the memory and the meshing progress in the background
+startWatch(memory_budget, stage_timeouts, progress_log, print_progress)
+
+if scaling_counts:
+    runScalingHarness(scaling_counts, scaling_size_factor)
+    printMemoryReport()
+    gmsh.finalize()
+    sys.exit()
+
 offset = -11.6128 
 
 ppe_volumes = ppe(0, offset, 0)
@@ -472,6 +601,13 @@ dragonxl_volumes = dragonxl(-(dim_halo[1] + dim_esprit[0] + 2 * tol ), offset +
 airlock_volumes = airlock(-(dim_ihab[1] + tol), offset + dim_ppe[0] + dim_halo[0] + dim_ihab[2] + 2 * tol, 0)
 
 station_volumes = [*ppe_volumes, *halo_volumes, *ihab_volumes, *orion_volumes, *bluemoon_volumes, *esprit_volumes, *dragonxl_volumes, *airlock_volumes]
+module_volumes = [ppe_volumes, halo_volumes, ihab_volumes, orion_volumes, bluemoon_volumes, esprit_volumes, dragonxl_volumes, airlock_volumes]
+
+# the surfaces of each module, for meshing them in parallel. they keep their tags through the cut below
+gmsh.model.occ.synchronize()
+module_surfaces = []
+for volumes in module_volumes:
+    module_surfaces.append([tag for _, tag in gmsh.model.getBoundary(volumes, combined=False, oriented=False)])
 
 # the offset to center the station. all the modules need to be created to find the length so you must run the script with the 2 lines below uncommented
 # to find the length, and then take the printed value and replace the offset declaration at the top with it.
@@ -479,23 +615,91 @@ station_volumes = [*ppe_volumes, *halo_volumes, *ihab_volumes, *orion_volumes, *
 # offset = -(dim_ppe[0] + dim_halo[0] + dim_ihab[0] + dim_orion[0] + 3 * tol)/2
 # print(offset)
 
-boundary = gmsh.model.occ.addSphere(0, 0, 0, boundary_radius)
+# the surfaces of every part of every module get its name, and with it a physical group and mesh size after the
+# boundary cut
+nameSurfaces()
+
+startPhase("booleans")
+
+if check_clearance:
+    too_close = checkClearance(min_clearance)
+    for first, second, distance in too_close:
+        print(first + " and " + second + " are " + str(round(distance, 4)) + " apart")
+    if too_close:
+        gmsh.finalize()
+        sys.exit(str(len(too_close)) + " pairs of physical groups are closer than " + str(min_clearance))
+
+if nested_far_field:
+    inner, shell = addNestedBoundary(0, 0, 0, boundary_radius, inner_boundary_radius, far_field_layers)
+    # the shell goes on before the station is cut out, a fragment afterwards would give the station surfaces new tags
+    _, out_map = booleanNamed("fragment", [(3, inner)], shell)
+    inner_pieces, _ = booleanNamed("cut", out_map[0], station_volumes)
+    gmsh.model.occ.synchronize()
 
-gmsh.model.occ.synchronize()
-_ , boundary_surfaces = gmsh.model.getAdjacencies(3, boundary)
-gmsh.model.occ.cut([(3, boundary)], station_volumes)
-gmsh.model.occ.synchronize()
+    inner_volumes = [tag for _, tag in inner_pieces]
+    shell_volumes = [tag for item in out_map[1:] for _, tag in item]
+    space_surfaces, interface_surfaces = classifyFarField(inner_volumes, shell_volumes)
 
-ps_space = gmsh.model.addPhysicalGroup(2, [*boundary_surfaces], name="Space")
-pv = gmsh.model.addPhysicalGroup(3, [boundary], name="Volume")
+    setName([(2, tag) for tag in space_surfaces], "Space")
+    boundary_volumes = [*inner_volumes, *shell_volumes]
+else:
+    boundary = gmsh.model.occ.addSphere(0, 0, 0, boundary_radius)
+
+    gmsh.model.occ.synchronize()
+    setName(gmsh.model.getBoundary([(3, boundary)], combined=False, oriented=False), "Space")
+    booleanNamed("cut", [(3, boundary)], station_volumes)
+    boundary_volumes = [boundary]
+
+ps_space = addNamedGroups()["Space"]
+pv = gmsh.model.addPhysicalGroup(3, boundary_volumes, name="Volume")
 
 
 # MESHING
 
 setMeshSize(ps_space, 0.1 * boundary_radius) 
 
+if nested_far_field:
+    interface_points = gmsh.model.getBoundary([(2, tag) for tag in interface_surfaces], combined=False, recursive=True)
+    gmsh.model.mesh.setSize(interface_points, ms_interface)
+
+if curvature_sizing:
+    setCurvatureSizing(curvature_sizing, curvature_points, curvature_clamp)
+
+if cost_report:
+    writeCostReport("gateway")
+
+startPhase("2D")
+
+if preview:
+    empty = writePreview("gateway", [ps_space])
+    printMemoryReport()
+    gmsh.finalize()
+    if empty:
+        sys.exit("empty physical groups: " + ", ".join(empty))
+    sys.exit()
+
 gmsh.model.occ.synchronize()
 gmsh.option.setNumber("Mesh.MshFileVersion", 2.2) # save msh in ASCII 2 format
 gmsh.write("gateway.brep")
-gmsh.model.mesh.generate(3)
-gmsh.write("gateway.msh")
\ No newline at end of file
+if multigrid_levels > 1:
+    gmsh.option.setNumber("Mesh.MeshSizeFactor", 2 ** (multigrid_levels - 1)) # coarsest level, each refinement halves the sizes
+if surface_checkpoint:
+    meshSurfacesWithCheckpoint("gateway", [ps_space])
+elif surface_workers > 1:
+    # one more job for everything that isn't a module: the boundary (and the far field shell)
+    station_surfaces = set(tag for surfaces in module_surfaces for tag in surfaces)
+    far_field_surfaces = [tag for _, tag in gmsh.model.getEntities(2) if tag not in station_surfaces]
+    meshSurfacesInParallel([*module_surfaces, far_field_surfaces], surface_workers)
+else:
+    gmsh.model.mesh.generate(2)
+startPhase("3D")
+meshVolumes() # only meshes the volume, the surfaces already are
+startPhase("write")
+if multigrid_levels > 1:
+    writeMultigridHierarchy("gateway", multigrid_levels) # gateway_0.msh, gateway_1.msh + gateway_1.transfer, ...
+else:
+    if renumbering:
+        renumberMesh(renumbering)
+    gmsh.write("gateway.msh")
+writeRotatedMeshes("gateway", sweep_axis, sweep_angles)
+printMemoryReport()
\ No newline at end of file
@@ -0,0 +1,758 @@
+import gmsh
+import hashlib
+import math
+import multiprocessing
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+
+# the helpers shared by the blue moon, starship and gateway scripts: naming the parts and making their physical
+# groups, mesh sizing, checks and reports on the model, writing the mesh in other forms, and following the build
+
+# function to set the mesh size of surfaces from its physical group tag
+def setMeshSize(physical_group, mesh_size):
+
+    global sizing_time
+    start = time.time()
+
+    gmsh.model.occ.synchronize()
+
+    # gets the lines that make up each physical surface, and then the points that make up each of those lines
+    points = []
+    for tag in gmsh.model.getEntitiesForPhysicalGroup(2, physical_group):
+        _, line = gmsh.model.getAdjacencies(2, tag)
+        for i in line:
+            _, pts = gmsh.model.getAdjacencies(1, i)
+            points.append(pts)
+    
+    points = list(set([item for sublist in points for item in sublist])) # flatten and filter out any duplicate points in tag list
+
+    # change the formatting to be (dim, tag) list
+    entities = []
+    for tag in points:
+        entities.append((0, tag))
+    
+    gmsh.model.mesh.setSize(entities, mesh_size)
+    group_sizes[physical_group] = mesh_size
+    sizing_time += time.time() - start
+
+group_sizes = {} # mesh size set on each physical group by setMeshSize, by tag
+sizing_time = 0 # seconds spent in setMeshSize, for the gateway's scaling harness
+
+# function to size the mesh from the curvature of the surfaces, with points elements per 2 pi of curvature. in
+# "replace" mode the sizes set on the points are ignored, and in "add" mode the smaller of the two is used. either
+# way the size on every entity is clamped between clamp[0] and clamp[1] times the mesh size of its physical group,
+# so flat faces don't go coarser than their group and small fillets don't go finer than a fraction of it. entities
+# outside the sized groups (and the volumes) are clamped to the widest range of all the groups
+def setCurvatureSizing(mode, points, clamp):
+
+    gmsh.model.occ.synchronize()
+
+    curvature_bounds.clear()
+    for group, size in group_sizes.items():
+        surfaces = [(2, tag) for tag in gmsh.model.getEntitiesForPhysicalGroup(2, group)]
+        curves = gmsh.model.getBoundary(surfaces, combined=False, oriented=False)
+        corners = gmsh.model.getBoundary(surfaces, combined=False, oriented=False, recursive=True)
+        for entity in [*surfaces, *curves, *corners]:
+            low, high = clamp[0] * size, clamp[1] * size
+            # entities shared by two groups get the tighter bounds
+            if entity in curvature_bounds:
+                low, high = min(low, curvature_bounds[entity][0]), min(high, curvature_bounds[entity][1])
+            curvature_bounds[entity] = (low, high)
+    curvature_bounds[None] = (clamp[0] * min(group_sizes.values()), clamp[1] * max(group_sizes.values()))
+
+    gmsh.option.setNumber("Mesh.MeshSizeFromCurvature", points)
+    if mode == "replace":
+        gmsh.option.setNumber("Mesh.MeshSizeFromPoints", 0)
+    gmsh.model.mesh.setSizeCallback(getCurvatureSize)
+
+# function called by gmsh for the mesh size at every point, to clamp the size from the curvature
+def getCurvatureSize(dim, tag, x, y, z, lc):
+    low, high = curvature_bounds.get((dim, tag), curvature_bounds[None])
+    return min(max(lc, low), high)
+
+curvature_bounds = {} # (low, high) mesh size bounds of every entity, by (dim, tag), the default under None
+
+# function to give entities a name, and optionally a mesh size for that name. the surfaces of named volumes end up
+# in a physical group of that name (see nameSurfaces and addNamedGroups), whatever booleans they go through
+def setName(dimtags, name, mesh_size=None):
+
+    for dimtag in dimtags:
+        entity_names[dimtag] = name
+    if name not in name_sizes or mesh_size is not None:
+        name_sizes[name] = mesh_size
+
+# function to get the entities of a dimension that have the name, as a (dim, tag) list
+def getNamed(name, dim=3):
+    return [dimtag for dimtag, entity_name in entity_names.items() if dimtag[0] == dim and entity_name == name]
+
+# function to copy entities, giving the copies the name of their original or, if there is one, the new name
+def copyNamed(dimtags, name=None, mesh_size=None):
+
+    copies = gmsh.model.occ.copy(dimtags)
+    for original, copy in zip(dimtags, copies):
+        if name:
+            setName([copy], name, mesh_size)
+        elif original in entity_names:
+            entity_names[copy] = entity_names[original]
+
+    return copies
+
+# function to run an OCC boolean operation ("fuse", "cut", "intersect" or "fragment") and carry the names of the
+# inputs over to the pieces they turned into, from the output map. a piece that comes from several inputs keeps the
+# name of the first one (objects before tools), and in a fuse the unnamed tools take the name of the object. the map
+# of an input comes back empty when a fuse merges it, so pieces of the output left without a name take the name of
+# the first named object. rotations and translations keep the tags, so the names stay as they are
+def booleanNamed(operation, objects, tools, **options):
+
+    inputs = [*objects, *tools]
+    input_names = [entity_names.pop(dimtag, None) for dimtag in inputs]
+    object_names = [name for name in input_names[:len(objects)] if name]
+    if operation == "fuse" and object_names:
+        input_names = [name or object_names[0] for name in input_names]
+
+    out, out_map = getattr(gmsh.model.occ, operation)(objects, tools, **options)
+
+    # the first input goes last, so its name wins
+    for name, pieces in reversed(list(zip(input_names, out_map))):
+        if name:
+            for piece in pieces:
+                entity_names[piece] = name
+
+    if object_names:
+        for piece in out:
+            entity_names.setdefault(piece, object_names[0])
+
+    return out, out_map
+
+# function to give the surfaces of every named volume the name of the volume. has to be called before the
+# boundary cut, which keeps the surfaces of the volumes it cuts out but not the volumes themselves
+def nameSurfaces():
+
+    gmsh.model.occ.synchronize()
+
+    for (dim, tag), name in list(entity_names.items()):
+        if dim == 3:
+            for surface in gmsh.model.getBoundary([(3, tag)], combined=False, oriented=False):
+                entity_names.setdefault(surface, name)
+
+# function to make a physical group of the surfaces of every name that doesn't have one yet, and set its mesh size if
+# the name has one. the groups of the names in order come first, then the others in the order the names were first
+# given. stops if a name has no surfaces left or a named surface was lost in a boolean operation, instead of leaving
+# a group short. returns the physical groups by name
+def addNamedGroups(order=()):
+
+    gmsh.model.occ.synchronize()
+
+    surfaces = {}
+    for (dim, tag), name in entity_names.items():
+        if dim == 2:
+            surfaces.setdefault(name, []).append(tag)
+
+    existing = set(tag for _, tag in gmsh.model.getEntities(2))
+    for name in [*order, *[name for name in name_sizes if name not in order]]:
+        if name not in surfaces:
+            gmsh.finalize()
+            sys.exit(name + " has no surfaces, its name was lost in a boolean operation")
+        if not existing.issuperset(surfaces[name]):
+            gmsh.finalize()
+            sys.exit("surfaces of " + name + " were lost in a boolean operation")
+        if name in named_groups:
+            continue
+
+        named_groups[name] = gmsh.model.addPhysicalGroup(2, sorted(surfaces[name]), name=name)
+        if name_sizes[name] is not None:
+            setMeshSize(named_groups[name], name_sizes[name])
+
+    return named_groups
+
+entity_names = {} # name of every named entity, by (dim, tag)
+name_sizes = {} # mesh size of every name (None if it has none), in the order the names were first given
+named_groups = {} # physical group made for every name by addNamedGroups
+
+# function to list the volume elements of the mesh as (tag, node tags) pairs
+def getVolumeElements():
+
+    elements = []
+    element_types, element_tags, node_tags = gmsh.model.mesh.getElements(3)
+    for element_type, tags, nodes in zip(element_types, element_tags, node_tags):
+        n = gmsh.model.mesh.getElementProperties(element_type)[3]
+        for i, tag in enumerate(tags):
+            elements.append((int(tag), [int(node) for node in nodes[n * i:n * (i + 1)]]))
+
+    return elements
+
+# function to renumber the nodes, and the elements with the numbers the msh 2.2 files end up with: that format numbers
+# only the elements in physical groups, in the order it writes them, which is by type (all the tets, then the prisms,
+# then the pyramids), and by entity for each type
+def renumberAsWritten():
+
+    gmsh.model.mesh.renumberNodes()
+
+    saved = []
+    unsaved = []
+    for dim, tag in gmsh.model.getEntities():
+        elements = saved if len(gmsh.model.getPhysicalGroupsForEntity(dim, tag)) else unsaved
+        element_types, element_tags, _ = gmsh.model.mesh.getElements(dim, tag)
+        for element_type, tags in zip(element_types, element_tags):
+            elements += [(dim, int(element_type), tag, int(element)) for element in tags]
+
+    old_tags = [element for *_, element in sorted(saved) + unsaved]
+    gmsh.model.mesh.renumberElements(old_tags, list(range(1, len(old_tags) + 1)))
+
+# function to write a hierarchy of nested meshes for geometric multigrid. level 0 is the current mesh, and every
+# level after it splits each element of the one before into 8 (pyramids into 6 pyramids and 4 tets). every refined
+# level also gets a .transfer file with the parent of each volume element, and the weights that interpolate each
+# node from the level before
+def writeMultigridHierarchy(name, levels):
+
+    # renumber so that the tags in the transfer files are the ones that end up in the .msh files
+    renumberAsWritten()
+    gmsh.write(name + "_0.msh")
+
+    for level in range(1, levels):
+
+        # refine and renumberNodes give the old nodes new tags, so they are found again by their coordinates,
+        # which the refinement leaves as they are
+        tags, coords, _ = gmsh.model.mesh.getNodes()
+        coarse_tags = {}
+        for i, tag in enumerate(tags):
+            coarse_tags[tuple(coords[3 * i:3 * i + 3])] = int(tag)
+        coarse_elements = {} # corners and tag of the coarse elements around every coarse node
+        for tag, nodes in getVolumeElements():
+            for node in nodes:
+                coarse_elements.setdefault(node, []).append((set(nodes), tag))
+
+        gmsh.model.mesh.refine()
+        renumberAsWritten()
+
+        tags, coords, _ = gmsh.model.mesh.getNodes()
+        coarse_nodes = {} # coarse tag of every fine node that was already in the coarse mesh, by fine tag
+        for i, tag in enumerate(tags):
+            position = tuple(coords[3 * i:3 * i + 3])
+            if position in coarse_tags:
+                coarse_nodes[int(tag)] = coarse_tags[position]
+
+        # nodes that no element uses are not written to the .msh files, so only the nodes of the elements are kept
+        fine_elements = getVolumeElements()
+        fine_nodes = sorted(set(node for _, nodes in fine_elements for node in nodes))
+
+        # every new node is on an edge, a face or in the middle of a coarse element, and the old nodes that it
+        # shares fine elements with are exactly the corners of that edge, face or element
+        parents = {}
+        for _, nodes in fine_elements:
+            corners = [coarse_nodes[node] for node in nodes if node in coarse_nodes]
+            for node in nodes:
+                if node not in coarse_nodes:
+                    parents.setdefault(node, set()).update(corners)
+
+        # the corners of all the nodes of a fine element are corners of its parent, and the only coarse element that
+        # has all of them. they are all its corners, except for the tet under the apex of a split pyramid
+        lines = ["$ParentElements", str(len(fine_elements))]
+        for tag, nodes in fine_elements:
+            corners = set()
+            for node in nodes:
+                corners.update(parents[node] if node in parents else [coarse_nodes[node]])
+            parent = next(coarse for coarse_corners, coarse in coarse_elements[min(corners)] if corners <= coarse_corners)
+            lines.append(str(tag) + " " + str(parent))
+        lines.append("$EndParentElements")
+
+        # each line is: fine node, number of coarse nodes, then (coarse node, weight) pairs
+        interpolation = []
+        for tag in fine_nodes:
+            if tag in coarse_nodes:
+                interpolation.append(str(tag) + " 1 " + str(coarse_nodes[tag]) + " 1")
+            elif tag in parents:
+                weight = repr(1 / len(parents[tag]))
+                interpolation.append(str(tag) + " " + str(len(parents[tag])) + "".join(" " + str(node) + " " + weight for node in sorted(parents[tag])))
+        lines += ["$Interpolation", str(len(interpolation)), *interpolation, "$EndInterpolation"]
+
+        with open(name + "_" + str(level) + ".transfer", "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        gmsh.write(name + "_" + str(level) + ".msh")
+
+# function to count the elements of every physical group (entities for groups whose dimension is not meshed yet,
+# and for the unmeshed groups) and print them. returns the names of the groups that are empty
+def checkPhysicalGroups(meshed_dim, unmeshed_groups=()):
+
+    empty = []
+    for dim, tag in gmsh.model.getPhysicalGroups():
+        name = gmsh.model.getPhysicalName(dim, tag)
+        entities = gmsh.model.getEntitiesForPhysicalGroup(dim, tag)
+        meshed = dim <= meshed_dim and tag not in unmeshed_groups
+        count = len(entities)
+        if meshed:
+            count = 0
+            for entity in entities:
+                count += sum(len(tags) for tags in gmsh.model.mesh.getElements(dim, entity)[1])
+        print(name + ": " + str(count) + (" elements" if meshed else " entities"))
+        if count == 0:
+            empty.append(name)
+
+    return empty
+
+# function for a quick look at the geometry without the volume mesh: meshes the surfaces of the spacecraft, checks
+# that no physical group is empty and writes <name>_preview.stl (binary) with one solid per physical group. the far
+# field groups are big and plain, so they are left unmeshed and only their surfaces are counted. returns the empty
+# groups
+def writePreview(name, far_field_groups):
+
+    spacecraft = []
+    for dim, tag in gmsh.model.getPhysicalGroups(2):
+        if tag not in far_field_groups:
+            spacecraft += [(2, surface) for surface in gmsh.model.getEntitiesForPhysicalGroup(dim, tag)]
+
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 1)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 0)
+    gmsh.model.setVisibility(spacecraft, 1, recursive=True)
+    gmsh.model.mesh.generate(2)
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 0)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 1)
+    empty = checkPhysicalGroups(2, far_field_groups)
+
+    gmsh.option.setNumber("Mesh.StlOneSolidPerSurface", 2) # solids are named after the physical groups
+    gmsh.option.setNumber("Mesh.Binary", 1)
+    gmsh.write(name + "_preview.stl")
+
+    return empty
+
+# function to find the pairs of bounding boxes (xmin, ymin, zmin, xmax, ymax, zmax) closer than margin to each
+# other, by sweep and prune: the boxes are sorted along x, so each box is only compared with the ones that are
+# still open (haven't ended along x) when it starts
+def getBoxPairs(boxes, margin):
+
+    pairs = []
+    active = []
+    for i in sorted(range(len(boxes)), key=lambda i: boxes[i][0]):
+        box = boxes[i]
+        active = [j for j in active if boxes[j][3] + margin >= box[0]]
+        for j in active:
+            other = boxes[j]
+            if all(other[k] - margin <= box[k + 3] and box[k] - margin <= other[k + 3] for k in [1, 2]):
+                pairs.append((j, i))
+        active.append(i)
+
+    return pairs
+
+# function to check the gaps between the volumes of different names (so of different physical groups) before the
+# boolean cut. only the pairs whose bounding boxes are close get the exact (and much slower) OCC distance. returns
+# the pairs closer than min_clearance as (name, name, distance), a distance of 0 meaning that they touch or overlap
+def checkClearance(min_clearance):
+
+    volumes = [tag for _, tag in gmsh.model.occ.getEntities(3)]
+    names = []
+    boxes = []
+    for tag in volumes:
+        names.append(entity_names.get((3, tag), "no name"))
+        boxes.append(gmsh.model.occ.getBoundingBox(3, tag))
+
+    too_close = []
+    for i, j in getBoxPairs(boxes, min_clearance):
+        if names[i] == names[j]:
+            continue
+        distance = gmsh.model.occ.getDistance(3, volumes[i], 3, volumes[j])[0]
+        if distance < min_clearance:
+            too_close.append((names[i], names[j], distance))
+
+    return sorted(too_close, key=lambda item: item[2])
+
+# function to get the affine transform (a 3x4 matrix by rows) of a rotation by angle degrees about the axis through
+# the origin, from the rodrigues formula
+def getRotation(axis, angle):
+
+    length = math.sqrt(sum(item ** 2 for item in axis))
+    x, y, z = [item / length for item in axis]
+    c = math.cos(math.radians(angle))
+    s = math.sin(math.radians(angle))
+    t = 1 - c
+
+    return [t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0,
+            t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0,
+            t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0]
+
+# function to write a rotated copy of the mesh for each angle (in degrees) about the axis, as <name>_rot<angle>.msh.
+# all the nodes are moved by one affine transform instead of remeshing the rotated geometry. the far field boundary
+# maps onto itself under these rotations, so the physical groups stay valid as they are
+def writeRotatedMeshes(name, axis, angles):
+
+    for angle in angles:
+        gmsh.model.mesh.affineTransform(getRotation(axis, angle))
+        gmsh.write(name + "_rot" + str(angle) + ".msh")
+        gmsh.model.mesh.affineTransform(getRotation(axis, -angle)) # back to the original orientation
+
+# function to measure how local the numbering of the volume mesh is: the bandwidth (largest difference between two
+# node tags of the same element, which is also the bandwidth of the solver matrix), the average of that difference,
+# and the average jump in node tags from one element to the next in the order they are written
+def getLocality():
+
+    elements = getVolumeElements()
+    spans = [max(nodes) - min(nodes) for _, nodes in elements]
+    jumps = [abs(min(elements[i][1]) - min(elements[i - 1][1])) for i in range(1, len(elements))]
+
+    return max(spans), sum(spans) / len(spans), sum(jumps) / max(len(jumps), 1)
+
+# function to renumber the nodes along gmsh's "RCMK" (reverse cuthill-mckee) or "Hilbert" (hilbert curve) ordering,
+# then reorder and renumber the elements of every entity by their lowest node, so both follow the same path through
+# the mesh. prints the locality before and after
+def renumberMesh(method):
+
+    before = getLocality()
+
+    old_tags, new_tags = gmsh.model.mesh.computeRenumbering(method)
+    gmsh.model.mesh.renumberNodes(old_tags, new_tags)
+
+    element_order = []
+    for dim, tag in gmsh.model.getEntities():
+        element_types, element_tags, element_nodes = gmsh.model.mesh.getElements(dim, tag)
+        for element_type, tags, nodes in zip(element_types, element_tags, element_nodes):
+            n = gmsh.model.mesh.getElementProperties(element_type)[3]
+            first_nodes = [min(nodes[n * i:n * (i + 1)]) for i in range(len(tags))]
+            ordering = sorted(range(len(tags)), key=lambda i: first_nodes[i])
+            gmsh.model.mesh.reorderElements(element_type, tag, ordering)
+            element_order.extend(int(tags[i]) for i in ordering)
+    gmsh.model.mesh.renumberElements(element_order, list(range(1, len(element_order) + 1)))
+
+    after = getLocality()
+    for label, values in [("before", before), ("after " + method, after)]:
+        print("locality " + label + ": bandwidth " + str(values[0]) + ", mean element span " + str(round(values[1], 1)) + ", mean jump between elements " + str(round(values[2], 1)))
+
+# function to estimate how many elements the thin features and narrow gaps of the model cost at the current mesh
+# sizes, and write them ranked to <name>_cost.txt. a face is thin when its width (2 area / perimeter) is smaller
+# than the mesh size of its group, and faces of two groups make a narrow gap when they are closer than the larger of
+# their mesh sizes. either way the mesher has to fill a layer that wide with tets that wide, so the estimate is the
+# number of regular tets of edge w in a slab of area A and thickness w: 6 sqrt(2) A / w^2
+def writeCostReport(name):
+
+    gmsh.model.occ.synchronize()
+
+    surface_groups = {}
+    surface_sizes = {}
+    for dim, tag in gmsh.model.getPhysicalGroups(2):
+        if tag in group_sizes:
+            for surface in gmsh.model.getEntitiesForPhysicalGroup(dim, tag):
+                surface_groups[surface] = gmsh.model.getPhysicalName(dim, tag)
+                surface_sizes[surface] = group_sizes[tag]
+
+    surfaces = sorted(surface_sizes)
+    areas = [gmsh.model.occ.getMass(2, tag) for tag in surfaces]
+
+    # (description, area, width) of every thin face and narrow gap
+    found = []
+    for tag, area in zip(surfaces, areas):
+        perimeter = sum(gmsh.model.occ.getMass(1, curve) for curve in gmsh.model.getAdjacencies(2, tag)[1])
+        width = 2 * area / perimeter
+        if width < surface_sizes[tag]:
+            found.append(("thin faces of " + surface_groups[tag], area, width))
+
+    boxes = [gmsh.model.occ.getBoundingBox(2, tag) for tag in surfaces]
+    for i, j in getBoxPairs(boxes, max(surface_sizes.values())):
+        first, second = surfaces[i], surfaces[j]
+        if surface_groups[first] == surface_groups[second]:
+            continue
+        distance = gmsh.model.occ.getDistance(2, first, 2, second)[0]
+        if 0 < distance < max(surface_sizes[first], surface_sizes[second]):
+            pair = sorted([surface_groups[first], surface_groups[second]])
+            found.append(("gap between " + pair[0] + " and " + pair[1], min(areas[i], areas[j]), distance))
+
+    # add up the cost, count and smallest width of each feature
+    features = {}
+    for description, area, width in found:
+        cost, count, smallest = features.get(description, (0, 0, width))
+        features[description] = (cost + 6 * math.sqrt(2) * area / width ** 2, count + 1, min(smallest, width))
+
+    lines = ["estimated elements | faces | smallest width | feature"]
+    for description, (cost, count, smallest) in sorted(features.items(), key=lambda item: -item[1][0]):
+        lines.append(str(round(cost)) + " | " + str(count) + " | " + str(round(smallest, 4)) + " | " + description)
+    lines.append("total: " + str(round(sum(item[0] for item in features.values()))))
+
+    print("\n".join(lines))
+    with open(name + "_cost.txt", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+# function to get the points, curves and surfaces that make up the given surfaces, as (dim, tag) lists in the
+# order their meshes have to be added back
+def getSurfaceClosure(surfaces):
+
+    curves = gmsh.model.getBoundary([(2, tag) for tag in surfaces], combined=False, oriented=False)
+    points = gmsh.model.getBoundary(curves, combined=False, oriented=False)
+
+    return sorted(set(points)) + sorted(set(curves)) + [(2, tag) for tag in surfaces]
+
+# function to get the nodes and elements of each entity, to add them back with addEntityMeshes
+def getEntityMeshes(entities):
+
+    meshes = []
+    for dim, tag in entities:
+        node_tags, coords, params = gmsh.model.mesh.getNodes(dim, tag, returnParametricCoord=True)
+        element_types, element_tags, element_nodes = gmsh.model.mesh.getElements(dim, tag)
+        meshes.append((dim, tag, node_tags, coords, params, element_types, element_tags, element_nodes))
+
+    return meshes
+
+# function to add the meshes from getEntityMeshes to the model, with their node and element tags shifted by the
+# offsets. returns the largest node and element tags of the meshes (before the shift)
+def addEntityMeshes(meshes, node_offset, element_offset):
+
+    max_node = 0
+    max_element = 0
+
+    # all the nodes go in first, since the elements of a surface use the nodes on its curves and points
+    for dim, tag, node_tags, coords, params, _, _, _ in meshes:
+        gmsh.model.mesh.addNodes(dim, tag, [int(node) + node_offset for node in node_tags], coords, params)
+        max_node = max([max_node, *node_tags])
+
+    for dim, tag, _, _, _, element_types, element_tags, element_nodes in meshes:
+        shifted_tags = [[int(element) + element_offset for element in tags] for tags in element_tags]
+        shifted_nodes = [[int(node) + node_offset for node in nodes] for nodes in element_nodes]
+        gmsh.model.mesh.addElements(dim, tag, element_types, shifted_tags, shifted_nodes)
+        for tags in element_tags:
+            max_element = max([max_element, *tags])
+
+    return int(max_node), int(max_element)
+
+# function to mesh only the volumes. generate(3) remeshes every curve and surface that gmsh didn't mesh itself in this
+# model, like the ones added with addEntityMeshes, so all of them are hidden from it and only the volumes are shown
+def meshVolumes():
+
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 1)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 0)
+    gmsh.model.setVisibility(gmsh.model.getEntities(3), 1)
+    gmsh.model.mesh.generate(3)
+
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 0)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 1)
+
+# function to get the key of a surface mesh checkpoint: a hash of everything the mesh of the entities depends on,
+# which is their tags, bounding boxes and shapes, the mesh sizes of the physical groups around each point, the
+# curvature bounds and the global mesh options. the far field boundary and its mesh size are left out on purpose
+def getCheckpointKey(entities):
+
+    point_sizes = {}
+    for group, size in group_sizes.items():
+        surfaces = [(2, tag) for tag in gmsh.model.getEntitiesForPhysicalGroup(2, group)]
+        for point in gmsh.model.getBoundary(surfaces, combined=False, oriented=False, recursive=True):
+            point_sizes.setdefault(point, []).append(size)
+
+    options = ["Algorithm", "MeshSizeFactor", "MeshSizeFromPoints", "MeshSizeFromCurvature", "MeshSizeFromCurvatureIsotropic",
+        "MeshSizeExtendFromBoundary", "MeshSizeMin", "MeshSizeMax", "RecombineAll", "RecombinationAlgorithm", "ElementOrder",
+        "SecondOrderLinear", "Smoothing", "RandomFactor"]
+    key = [gmsh.option.getNumber("Mesh." + option) for option in options]
+    for dim, tag in entities:
+        box = [round(value, 6) for value in gmsh.model.getBoundingBox(dim, tag)]
+        # the box misses changes of shape inside it, like the profile of the nosecone, which the coordinates of the
+        # points and the lengths and areas of the curves and surfaces catch
+        if dim == 0:
+            shape = [round(value, 6) for value in gmsh.model.getValue(0, tag, [])]
+        else:
+            shape = round(gmsh.model.occ.getMass(dim, tag), 6)
+        key.append((dim, tag, box, shape, sorted(point_sizes.get((dim, tag), [])), curvature_bounds.get((dim, tag))))
+
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+# function to mesh the surfaces, reusing the spacecraft surface mesh saved in <name>_surface.ckpt if nothing it
+# depends on has changed (see getCheckpointKey), so only the far field surfaces get meshed. otherwise meshes all the
+# surfaces and saves the spacecraft ones for the next run. the spacecraft is every surface in a physical group that
+# isn't one of far_field_groups
+def meshSurfacesWithCheckpoint(name, far_field_groups):
+
+    gmsh.model.occ.synchronize()
+
+    spacecraft = set()
+    for _, group in gmsh.model.getPhysicalGroups(2):
+        if group not in far_field_groups:
+            spacecraft.update(gmsh.model.getEntitiesForPhysicalGroup(2, group))
+    entities = getSurfaceClosure(sorted(spacecraft))
+    key = getCheckpointKey(entities)
+
+    path = name + "_surface.ckpt"
+    checkpoint_key, meshes = None, None
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            checkpoint_key, meshes = pickle.load(f)
+
+    if checkpoint_key != key:
+        gmsh.model.mesh.generate(2)
+        with open(path, "wb") as f:
+            pickle.dump((key, getEntityMeshes(entities)), f)
+        print("saved the spacecraft surface mesh to " + path)
+        return
+
+    print("reusing the spacecraft surface mesh from " + path)
+
+    # the curves of the far field go first, since generate(2) doesn't mesh curves once the model has a mesh. the
+    # curves and points the spacecraft shares with the far field stay hidden so they come from the checkpoint
+    far_field = [(2, tag) for _, tag in gmsh.model.getEntities(2) if tag not in spacecraft]
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 1)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 0)
+    gmsh.model.setVisibility(far_field, 1, recursive=True)
+    gmsh.model.setVisibility(entities, 0)
+    gmsh.model.mesh.generate(1)
+
+    # then the spacecraft, numbered after those curves, and the far field surfaces around it
+    addEntityMeshes(meshes, gmsh.model.mesh.getMaxNodeTag(), gmsh.model.mesh.getMaxElementTag())
+    gmsh.model.mesh.generate(2)
+
+    gmsh.option.setNumber("Mesh.MeshOnlyVisible", 0)
+    gmsh.model.setVisibility(gmsh.model.getEntities(), 1)
+
+# function to read how much memory this process is using (resident set size, in MB)
+def getMemory():
+
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+# function to mark the start of a build phase (geometry, booleans, 2D, 3D, write) for the memory report and the
+# watchdog. meshing starts with the 2D phase, which is when gmsh's log starts being followed, if anything needs it
+def startPhase(name):
+
+    global phase, phase_start, last_entity
+    with progress_lock:
+        # what gmsh logged so far still belongs to the phase that ends here
+        if log_position is not None:
+            readProgress()
+        phase = name
+        phase_start = time.time()
+        phase_peaks[name] = getMemory()
+        if name == "2D" and (print_progress or progress_log or any(stage_timeouts.values())):
+            startProgress()
+        if name == "3D" and log_position is not None:
+            # the delaunay mesher only names a volume once it has recovered its boundary, until then it is the first
+            last_entity = ("volume", gmsh.model.getEntities(3)[0][1])
+
+# function to get ready to follow the meshing in gmsh's log: starts the logger, and finds the number of entities of
+# each kind and the physical groups of each entity now, so that the watchdog thread doesn't have to ask gmsh
+def startProgress():
+
+    global log_position
+    gmsh.logger.start()
+    log_position = 0
+
+    for dim, kind in enumerate(["point", "curve", "surface", "volume"]):
+        progress_totals[kind] = len(gmsh.model.getEntities(dim))
+
+    for dim, tag in gmsh.model.getPhysicalGroups():
+        name = gmsh.model.getPhysicalName(dim, tag)
+        for entity in gmsh.model.getEntitiesForPhysicalGroup(dim, tag):
+            entity_groups.setdefault((dim, entity), []).append(name)
+
+    # curves aren't in physical groups, so they get the groups of their surfaces
+    for _, tag in gmsh.model.getEntities(1):
+        for surface in gmsh.model.getAdjacencies(1, tag)[0]:
+            entity_groups.setdefault((1, tag), []).extend(entity_groups.get((2, surface), []))
+
+# function to read the new lines of gmsh's log, and report every entity of the phase that has started being meshed.
+# only the kinds the phase meshes count, so a curve or surface remeshed in 3D isn't blamed for the volume mesh
+def readProgress():
+
+    global log_position, last_entity
+    with progress_lock:
+        log = gmsh.logger.get()
+        for line in log[log_position:]:
+            match = re.search(r"(?:Meshing|Found|Optimizing) (curve|surface|volume) (\d+)", line)
+            if match and match.group(1) in phase_kinds.get(phase, []):
+                kind = match.group(1)
+                last_entity = (kind, int(match.group(2)))
+                meshed.setdefault((phase, kind), set()).add(last_entity[1])
+                reportProgress(phase, kind, len(meshed[(phase, kind)]), progress_totals[kind], time.time() - phase_start)
+        log_position = len(log)
+
+# function called for every progress event: prints it if print_progress is on, and appends it to progress_log if
+# there is one
+def reportProgress(stage, kind, done, total, elapsed):
+
+    line = stage + ": " + kind + " " + str(done) + "/" + str(total) + " after " + str(round(elapsed, 1)) + " s"
+    if print_progress:
+        print(line, flush=True)
+    if progress_log:
+        with open(progress_log, "a") as f:
+            f.write(line + "\n")
+
+# function to write what was being meshed when a stage timed out, to stderr and to <script>_watchdog.txt
+def writeWatchdogReport():
+
+    lines = [phase + " stage took longer than " + str(stage_timeouts[phase]) + " s"]
+    if last_entity:
+        kind, tag = last_entity
+        groups = entity_groups.get((["point", "curve", "surface", "volume"].index(kind), tag), [])
+        lines.append("last entity being meshed: " + kind + " " + str(tag))
+        lines.append("physical groups: " + (", ".join(sorted(set(groups))) or "none"))
+
+    print("\n".join(lines), file=sys.stderr, flush=True)
+    with open(os.path.splitext(os.path.basename(sys.argv[0]))[0] + "_watchdog.txt", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+# function to stop the worker processes forked from this one (the gateway's surface workers), so that they don't
+# go on meshing after the build is aborted
+def stopWorkers():
+
+    for process in multiprocessing.active_children():
+        process.terminate()
+
+# function that runs in a background thread: keeps the peak memory of the current phase, follows the meshing
+# progress in gmsh's log, and enforces the memory budget and the stage timeouts. gmsh can't be interrupted in the
+# middle of meshing, so when a limit is exceeded it reports, stops the workers and exits the process right away.
+# every poll holds progress_lock, so the main thread can fork while holding it without the copy of this thread
+# being stuck halfway through a gmsh call or a print in the child.
+# NOTE: gmsh is not thread safe. gmsh.logger.get is the only gmsh call made from this thread (none at all when the
+# progress isn't followed), and it copies the log while the main thread may be adding to it inside generate. gmsh doesn't promise that this works, it is kept to a
+# copy of the log once a second, and everything else about the model is read before meshing starts
+def watchBuild():
+
+    polls = 0
+    while True:
+        with progress_lock:
+            memory = getMemory()
+            phase_peaks[phase] = max(phase_peaks.get(phase, 0), memory)
+            if memory_budget and memory > memory_budget:
+                printMemoryReport()
+                print("memory budget of " + str(memory_budget) + " MB exceeded during " + phase, file=sys.stderr, flush=True)
+                stopWorkers()
+                os._exit(1)
+
+            if log_position is not None and polls % 10 == 0:
+                readProgress()
+
+            if stage_timeouts.get(phase) and time.time() - phase_start > stage_timeouts[phase]:
+                if log_position is not None:
+                    readProgress()
+                writeWatchdogReport()
+                printMemoryReport()
+                stopWorkers()
+                os._exit(1)
+
+        polls += 1
+        time.sleep(0.1)
+
+# function to print the peak memory of every phase so far
+def printMemoryReport():
+
+    for name, peak in list(phase_peaks.items()):
+        print("peak memory during " + name + ": " + str(round(peak)) + " MB", flush=True)
+
+# follow the memory and the meshing progress in the background
+phase_peaks = {} # peak memory of each phase, in MB
+progress_totals = {} # number of entities of each kind
+entity_groups = {} # physical group names of each (dim, tag)
+meshed = {} # entities that started meshing, for each (phase, kind)
+log_position = None # lines of gmsh's log already read
+last_entity = None # last (kind, tag) that started meshing
+phase_kinds = {"2D": ["curve", "surface"], "3D": ["volume"]} # kinds of entity meshed in each phase
+progress_lock = threading.RLock() # held by the watcher thread while it polls, and by the main thread to read the progress or fork
+stage_timeouts = {} # seconds each meshing stage may take (0 for no limit), set by startWatch
+memory_budget = 0 # MB the build may use (0 for no limit), set by startWatch
+progress_log = None # file to append the meshing progress to, set by startWatch
+print_progress = False # print the meshing progress, set by startWatch
+
+# function to start following the memory of the build in a background thread, with the limits of the script. the
+# meshing progress is only followed when it is printed or logged, or a stage has a timeout. the build starts in
+# the geometry phase
+def startWatch(budget, timeouts, log, show):
+
+    global memory_budget, stage_timeouts, progress_log, print_progress
+    memory_budget, stage_timeouts, progress_log, print_progress = budget, timeouts, log, show
+    startPhase("geometry")
+    threading.Thread(target=watchBuild, daemon=True).start()
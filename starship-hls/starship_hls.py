@@ -1,29 +1,87 @@
 import gmsh
+import os
+import sys
 from math import pi
 
-gmsh.initialize()
-
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # mesh_tools.py is one folder up
+from mesh_tools import (setMeshSize, setCurvatureSizing, setName, getNamed, copyNamed, booleanNamed, nameSurfaces,
+    addNamedGroups, writeMultigridHierarchy, writePreview, checkClearance, writeRotatedMeshes, renumberMesh,
+    writeCostReport, meshSurfacesWithCheckpoint, meshVolumes, startPhase, printMemoryReport, startWatch)
 
-def setMeshSize(physical_group, mesh_size):
-    
-    gmsh.model.occ.synchronize()
+gmsh.initialize()
 
-    # gets the lines that make up each physical surface, and then the points that make up each of those lines
-    points = []
-    for tag in gmsh.model.getEntitiesForPhysicalGroup(2, physical_group):
-        _, line = gmsh.model.getAdjacencies(2, tag)
-        for i in line:
-            _, pts = gmsh.model.getAdjacencies(1, i)
-            points.append(pts)
-    
-    points = list(set([item for sublist in points for item in sublist])) # flatten and filter out any duplicate points in tag list
 
-    # change the formatting to be (dim, tag) list
-    entities = []
-    for tag in points:
-        entities.append((0, tag))
-    
-    gmsh.model.mesh.setSize(entities, mesh_size)
+# function to build the boundary as an inner cylinder (meshed with tets) nested inside an outer shell. the shell
+# is made by revolving its L shaped cross section around the axis, so it gets meshed as layers of prisms that are
+# conformal with the surface of the inner cylinder. gmsh only extrudes a mesh by revolution for angles below 2*pi,
+# so the shell is revolved in quarters, and the inner cylinder is fused from quarters with their faces left apart
+# (the prisms don't match a whole cylinder, whose side is one periodic face). returns the inner volume and the
+# shell volumes
+def addNestedBoundary(x, y, z, dz, r, inner_dz, inner_r, layers):
+
+    quarters = []
+    for index in range(4):
+        quarters.append((3, gmsh.model.occ.addCylinder(x, y, z, 0, 0, inner_dz, inner_r, angle=pi/2)))
+        gmsh.model.occ.rotate([quarters[-1]], x, y, z, 0, 0, 1, index * pi/2)
+
+    unify = gmsh.option.getNumber("Geometry.OCCUnionUnify")
+    gmsh.option.setNumber("Geometry.OCCUnionUnify", 0)
+    inner = gmsh.model.occ.fuse(quarters[:1], quarters[1:])[0][0][1]
+    gmsh.option.setNumber("Geometry.OCCUnionUnify", unify)
+
+    # cross section of the shell in the xz plane
+    p1 = gmsh.model.occ.addPoint(x + inner_r, y, z)
+    p2 = gmsh.model.occ.addPoint(x + r, y, z)
+    p3 = gmsh.model.occ.addPoint(x + r, y, z + dz)
+    p4 = gmsh.model.occ.addPoint(x, y, z + dz)
+    p5 = gmsh.model.occ.addPoint(x, y, z + inner_dz)
+    p6 = gmsh.model.occ.addPoint(x + inner_r, y, z + inner_dz)
+
+    lines = []
+    for start, end in [(p1, p2), (p2, p3), (p3, p4), (p4, p5), (p5, p6), (p6, p1)]:
+        lines.append(gmsh.model.occ.addLine(start, end))
+    c1 = gmsh.model.occ.addCurveLoop(lines)
+    s1 = gmsh.model.occ.addPlaneSurface([c1])
+
+    section = (2, s1)
+    shell = []
+    for index in range(4):
+        v1 = gmsh.model.occ.revolve([section], x, y, z, 0, 0, 1, pi/2, numElements=[max(1, (layers + index) // 4)], recombine=True)
+        section = v1[0]
+        shell += [dimtag for dimtag in v1 if dimtag[0] == 3]
+
+    return inner, shell
+
+# function to sort the outer surfaces of a nested boundary into ground (the plane z = ground_z), space, and the
+# interface between the inner and shell volumes. surfaces of the inner volume that are not on the ground are the
+# spacecraft, so they are left out
+def classifyFarField(inner_volumes, shell_volumes, ground_z):
+
+    inner_surfaces = set()
+    for tag in inner_volumes:
+        inner_surfaces.update(gmsh.model.getAdjacencies(3, tag)[1])
+
+    shell_surfaces = set()
+    between = set() # surfaces between two quarters of the shell, inside the boundary
+    for tag in shell_volumes:
+        surfaces = gmsh.model.getAdjacencies(3, tag)[1]
+        between.update(shell_surfaces.intersection(surfaces))
+        shell_surfaces.update(surfaces)
+
+    interface = inner_surfaces & shell_surfaces
+
+    ground = []
+    space = []
+    for tag in sorted(inner_surfaces | shell_surfaces):
+        if tag in interface or tag in between:
+            continue
+        zmax = gmsh.model.getBoundingBox(2, tag)[5]
+        if abs(zmax - ground_z) < 1e-6:
+            ground.append(tag)
+        elif tag in shell_surfaces:
+            space.append(tag)
+
+    return space, ground, sorted(interface)
 
 
 ######## MODEL PARAMETERS ########
@@ -53,6 +111,15 @@ boundary_radius = 30
 
 # spacing for different physical groups
 spacing = 0.1
+check_clearance = True # stop before the boolean cut if two physical groups are closer than min_clearance
+min_clearance = 0.5 * spacing
+cost_report = False # estimate the elements that thin features and narrow gaps cost, ranked in starship_hls_cost.txt
+
+# nested far field
+nested_far_field = False # split the boundary into a refined inner cylinder and a coarse outer shell of prism layers
+inner_boundary_radius = 14 # inner cylinder radius
+inner_boundary_height = 60 # inner cylinder height, measured from the lunar surface
+far_field_layers = 36 # number of prism layers around the axis in the outer shell
 
 ######## MESH PARAMETERS ########
 
@@ -62,6 +129,19 @@ meshsize_solarpanels = 0.2
 meshsize_landinglegs = 0.2
 meshsize_lunarsurface = 0.1 * boundary_radius
 meshsize_space = 0.1 * boundary_radius
+meshsize_interface = 0.05 * boundary_radius # surface between the inner cylinder and the outer shell (nested far field)
+memory_budget = 0 # abort the build if it uses more than this many MB of memory (0 for no limit)
+stage_timeouts = {"2D": 0, "3D": 0} # abort a meshing stage if it takes longer than this many seconds (0 for no limit)
+progress_log = None # file to append the meshing progress to
+print_progress = False # print every curve, surface and volume as it starts meshing
+renumbering = None # "RCMK" or "Hilbert" to reorder the nodes and elements for solver locality (not with multigrid)
+sweep_angles = [] # also write the mesh rotated about the z axis by each of these angles (degrees), for orientation sweeps
+multigrid_levels = 1 # write this many nested meshes for multigrid, the finest one is meshed at the sizes above
+curvature_sizing = None # "replace" or "add" to size the mesh from the curvature of the surfaces, instead of or on top of the sizes above
+curvature_points = 20 # elements per 2 pi of curvature
+curvature_clamp = (0.25, 1) # the curvature sizes are kept between these factors of the mesh size of each physical group
+preview = False # only mesh the surfaces and write starship_hls_preview.stl, to check the geometry quickly
+surface_checkpoint = False # reuse the spacecraft surface mesh saved in starship_hls_surface.ckpt when only the far field changed
 
 
 
@@ -73,9 +153,14 @@ meshsize_space = 0.1 * boundary_radius
 
 
 
+# follow the memory and the meshing progress in the background
+startWatch(memory_budget, stage_timeouts, progress_log, print_progress)
+
+
 ######## FUSELAGE ########
 
 lander = gmsh.model.occ.addCylinder(0, 0, 0, 0, 0, fuselage_height, fuselage_radius)
+setName([(3, lander)], "Lander", meshsize_fuselage)
 
 # nose cone
 p1 = gmsh.model.occ.addPoint(fuselage_radius, 0, fuselage_height)
@@ -92,7 +177,7 @@ for dimtag in v1:
     if dimtag[0] == 3:
         nosecone = dimtag
         break
-gmsh.model.occ.fuse([(3, lander)], [nosecone])
+booleanNamed("fuse", getNamed("Lander"), [nosecone])
 gmsh.model.occ.remove(v1, recursive=True)
 
 gmsh.model.occ.synchronize()
@@ -101,8 +186,8 @@ gmsh.write("fuselage.brep")
 # engine bay
 v1 = gmsh.model.occ.addCylinder(0, 0, 0, 0, 0, engine_bay_height, fuselage_radius - engine_bay_thickness) # empty space for engine bay
 v2 = gmsh.model.occ.addCone(0, 0, engine_bay_height, 0, 0, - engine_bay_height / 2, fuselage_radius - engine_bay_thickness, 0) # add small inverted cone at the top of the engine bay
-gmsh.model.occ.cut([(3,lander)], [(3, v1)]) # remove the space from the fuselage
-gmsh.model.occ.fuse([(3,lander)], [(3, v2)]) # fuse the cone with the fuselage
+booleanNamed("cut", getNamed("Lander"), [(3, v1)]) # remove the space from the fuselage
+booleanNamed("fuse", getNamed("Lander"), [(3, v2)]) # fuse the cone with the fuselage
 
 
 ######## ENGINES ########
@@ -122,21 +207,18 @@ for index in range(0, 2):
     gmsh.model.occ.rotate([large_engine_list[-1]], 0, 0, 0, 0, 0, 1, 2*pi/3)
 
 
-temp =  gmsh.model.occ.fuse([(3,lander)], small_engine_list)
-lander = temp[0][0][1]
-
-gmsh.model.occ.fuse([(3,lander)], large_engine_list)
+booleanNamed("fuse", getNamed("Lander"), small_engine_list)
+booleanNamed("fuse", getNamed("Lander"), large_engine_list)
 
 ######## SOLAR PANELS ########
 
 v1 = gmsh.model.occ.addCylinder(0, 0, fuselage_height*13/16 , 0, 0, 6, fuselage_radius + 0.2, angle = 0.8*pi/4)
 v2 = gmsh.model.occ.addCylinder(0, 0, fuselage_height*13/16 , 0, 0, 6, fuselage_radius + 0.1, angle = 0.8*pi/4)
-gmsh.model.occ.cut([(3, v1)], [(3, v2)])
-
-solar_panel_list = [(3,v1)]
+setName([(3, v1)], "Solar Panel 1", meshsize_solarpanels)
+solar_panel_list, _ = booleanNamed("cut", [(3, v1)], [(3, v2)])
 
 for index in range(0, 7):
-    solar_panel_list.append(gmsh.model.occ.copy([solar_panel_list[-1]])[0])
+    solar_panel_list.append(copyNamed([solar_panel_list[-1]], "Solar Panel " + str(index + 2), meshsize_solarpanels)[0])
     gmsh.model.occ.rotate([solar_panel_list[-1]], 0, 0, 0, 0, 0, 1, 2*pi/8)
 
 
@@ -207,7 +289,7 @@ for index in range(1,4):
     housing_list.append(gmsh.model.occ.copy([housing_list[-1]])[0])
     gmsh.model.occ.rotate([housing_list[-1]], 0, 0, 0, 0, 0, 1, pi/2)
 
-gmsh.model.occ.fuse([(3,lander)], housing_list)
+booleanNamed("fuse", getNamed("Lander"), housing_list)
 
 
 ######## LANDING LEGS ########
@@ -215,13 +297,14 @@ gmsh.model.occ.fuse([(3,lander)], housing_list)
 landing_gear = gmsh.model.occ.addBox(0 - 0.2, fuselage_radius - 0.5, 2/5 * landing_leg_housing_height + 0.2, 0 + 0.4, landing_leg_length, 0.4)
 gmsh.model.occ.rotate([(3, landing_gear)], 0, fuselage_radius, 2/5 * landing_leg_housing_height, 1, 0, 0, -pi/3)
 gmsh.model.occ.translate([(3, landing_gear)],0, -0.25, -1/4 * landing_leg_housing_height)
+setName([(3, landing_gear)], "Landing Leg 1", meshsize_landinglegs)
 
 
 # landing_gear = gmsh.model.occ.addCylinder(0, fuselage_radius - 0.25 + 4, 2/5 * landing_leg_housing_height, 0, fuselage_radius,  -landing_leg_length, 1)
 
 box = gmsh.model.occ.addBox(0 - fuselage_radius - spacing, 0 - fuselage_radius - spacing, -10, 2* fuselage_radius + 2 * spacing, 2 * fuselage_radius + 2 * spacing, 50)
 
-gmsh.model.occ.cut([(3, landing_gear)], [(3, box)])
+booleanNamed("cut", [(3, landing_gear)], [(3, box)])
 p1 = gmsh.model.occ.addPoint(landing_leg_housing_width, fuselage_radius - engine_bay_thickness, 0)
 p2 = gmsh.model.occ.addPoint(-landing_leg_housing_width, fuselage_radius - engine_bay_thickness, 0)
 
@@ -261,88 +344,114 @@ for dimtag in v4:
         foot = dimtag
         break
 
-gmsh.model.occ.fuse([(3, landing_gear)], [foot])
+booleanNamed("fuse", [(3, landing_gear)], [foot])
 gmsh.model.occ.remove(v4, recursive=True)
 
-landing_gear_list = [(3,landing_gear)]
+landing_gear_list = getNamed("Landing Leg 1")
 
 for index in range(1,4):
-    landing_gear_list.append(gmsh.model.occ.copy([landing_gear_list[-1]])[0])
+    landing_gear_list.append(copyNamed([landing_gear_list[-1]], "Landing Leg " + str(index + 1), meshsize_landinglegs)[0])
     gmsh.model.occ.rotate([landing_gear_list[-1]], 0, 0, 0, 0, 0, 1, pi/2)
 
 ######## BOUNDARY & PHYSICAL GROUPS ########
 
-gmsh.model.occ.synchronize()
-
-
-# lander = 1
-
-# _, lander_tags = gmsh.model.getAdjacencies(3, lander)
-# lander_tags = lander_tags + [18, 19, 20, 21, 22]
-# ps_lander = gmsh.model.addPhysicalGroup(2, lander_tags, name="Lander")
-
-sp_surfaces = []
-ps_solar_panel_list = []
-i = 0
-for volume in solar_panel_list:
-    i = i + 1
-    up, surface_tags = gmsh.model.getAdjacencies(*volume)
-    sp_surfaces.append(surface_tags)
-    name = "Solar Panel " + str(i)
-    ps_solar_panel_list.append(gmsh.model.addPhysicalGroup(2, surface_tags, name=name))
-    
-lg_surfaces = []
-ps_landing_gear_list = []   
-i = 0    
-for volume in landing_gear_list:
-    i = i + 1 
-    up, surface_tags = gmsh.model.getAdjacencies(*volume)
-    lg_surfaces.append(surface_tags)
-    name = "Landing Leg " + str(i)
-    ps_landing_gear_list.append(gmsh.model.addPhysicalGroup(2, surface_tags, name=name))
+# every part's surfaces get its name, and with it a physical group and mesh size after the boundary cut
+nameSurfaces()
 
+startPhase("booleans")
 
+if check_clearance:
+    too_close = checkClearance(min_clearance)
+    for first, second, distance in too_close:
+        print(first + " and " + second + " are " + str(round(distance, 4)) + " apart")
+    if too_close:
+        gmsh.finalize()
+        sys.exit(str(len(too_close)) + " pairs of physical groups are closer than " + str(min_clearance))
 
 volumes = gmsh.model.occ.getEntities(3)
-boundary = gmsh.model.occ.addCylinder(0, 0, -5, 0, 0, boundary_height, boundary_radius)
-gmsh.model.occ.synchronize()
-gmsh.model.occ.synchronize()
-
-
-_ , boundary_surfaces = gmsh.model.getAdjacencies(3, boundary)
-gmsh.model.occ.cut([(3, boundary)], volumes)
-gmsh.model.occ.synchronize()
-
-
-ps_space = gmsh.model.addPhysicalGroup(2, [boundary_surfaces[0],boundary_surfaces[1]], name="Space")
-ps_lunar_surface = gmsh.model.addPhysicalGroup(2, [boundary_surfaces[2]], name="Lunar Surface")
 
-all_surfaces_dimtag = gmsh.model.occ.getEntities(2)
-all_surfaces = [item[1] for item in all_surfaces_dimtag]
+if nested_far_field:
+    inner, shell = addNestedBoundary(0, 0, -5, boundary_height, boundary_radius, inner_boundary_height, inner_boundary_radius, far_field_layers)
+    # the shell goes on before the lander is cut out, a fragment afterwards would give the lander surfaces new tags
+    _, out_map = booleanNamed("fragment", [(3, inner)], shell)
+    inner_pieces, _ = booleanNamed("cut", out_map[0], volumes)
+    gmsh.model.occ.synchronize()
 
+    inner_volumes = [tag for _, tag in inner_pieces]
+    shell_volumes = [tag for item in out_map[1:] for _, tag in item]
+    space_surfaces, ground_surfaces, interface_surfaces = classifyFarField(inner_volumes, shell_volumes, -5)
 
-not_lander_surfaces = [item for sublist in [boundary_surfaces, *sp_surfaces, *lg_surfaces] for item in sublist]
-lander_surfaces = list(filter(lambda x: x not in not_lander_surfaces, all_surfaces))
+    setName([(2, tag) for tag in space_surfaces], "Space")
+    setName([(2, tag) for tag in ground_surfaces], "Lunar Surface")
+    boundary_volumes = [*inner_volumes, *shell_volumes]
+else:
+    boundary = gmsh.model.occ.addCylinder(0, 0, -5, 0, 0, boundary_height, boundary_radius)
+    gmsh.model.occ.synchronize()
 
+    # the lunar surface is the bottom of the cylinder, and the rest of it is space
+    boundary_surfaces = gmsh.model.getBoundary([(3, boundary)], combined=False, oriented=False)
+    ground_surfaces = [surface for surface in boundary_surfaces if gmsh.model.getBoundingBox(*surface)[5] < -5 + spacing]
+    setName([surface for surface in boundary_surfaces if surface not in ground_surfaces], "Space")
+    setName(ground_surfaces, "Lunar Surface")
 
-ps_lander = gmsh.model.addPhysicalGroup(2, lander_surfaces, name="Lander")
+    booleanNamed("cut", [(3, boundary)], volumes)
+    boundary_volumes = [boundary]
 
-pv = gmsh.model.addPhysicalGroup(3, [boundary], name="Volume")
+# the groups keep the tags they had before they were named: the solar panels (1-8), the landing legs (9-12), space,
+# the lunar surface and the lander
+panels = ["Solar Panel " + str(index + 1) for index in range(8)]
+legs = ["Landing Leg " + str(index + 1) for index in range(4)]
+groups = addNamedGroups([*panels, *legs, "Space", "Lunar Surface", "Lander"])
+ps_space = groups["Space"]
+ps_lunar_surface = groups["Lunar Surface"]
+pv = gmsh.model.addPhysicalGroup(3, boundary_volumes, name="Volume")
 
 
 ######## MESHING ########
 
 gmsh.model.occ.synchronize()
 
-setMeshSize(ps_lander, meshsize_fuselage)
-[setMeshSize(item, meshsize_solarpanels) for item in ps_solar_panel_list]
-[setMeshSize(item, meshsize_landinglegs) for item in ps_landing_gear_list]
 setMeshSize(ps_lunar_surface, meshsize_lunarsurface)
 setMeshSize(ps_space, meshsize_space)
 
+if nested_far_field:
+    interface_points = gmsh.model.getBoundary([(2, tag) for tag in interface_surfaces], combined=False, recursive=True)
+    gmsh.model.mesh.setSize(interface_points, meshsize_interface)
+
+if curvature_sizing:
+    setCurvatureSizing(curvature_sizing, curvature_points, curvature_clamp)
+
+if cost_report:
+    writeCostReport("starship_hls")
+
+startPhase("2D")
+
+if preview:
+    empty = writePreview("starship_hls", [ps_space, ps_lunar_surface])
+    printMemoryReport()
+    gmsh.finalize()
+    if empty:
+        sys.exit("empty physical groups: " + ", ".join(empty))
+    sys.exit()
+
 gmsh.write("starship_hls.brep")
 
 gmsh.option.setNumber("Mesh.MshFileVersion", 2.2) # save msh in ASCII 2 format
-gmsh.model.mesh.generate(3)
-gmsh.write("starship_hls.msh")
+if multigrid_levels > 1:
+    gmsh.option.setNumber("Mesh.MeshSizeFactor", 2 ** (multigrid_levels - 1)) # coarsest level, each refinement halves the sizes
+if surface_checkpoint:
+    meshSurfacesWithCheckpoint("starship_hls", [ps_space, ps_lunar_surface])
+else:
+    gmsh.model.mesh.generate(2)
+startPhase("3D")
+meshVolumes() # only meshes the volume, the surfaces already are
+startPhase("write")
+if multigrid_levels > 1:
+    writeMultigridHierarchy("starship_hls", multigrid_levels) # starship_hls_0.msh, starship_hls_1.msh + starship_hls_1.transfer, ...
+else:
+    if renumbering:
+        renumberMesh(renumbering)
+    gmsh.write("starship_hls.msh")
+writeRotatedMeshes("starship_hls", [0, 0, 1], sweep_angles) # the boundary cylinder is centered on the z axis
+printMemoryReport()
 gmsh.finalize()
\ No newline at end of file